@@ -0,0 +1,408 @@
+"""
+Resizing many images to many sizes, spread over several processes.
+
+Each image is decoded once, in the main process, into a block of shared
+memory. Worker processes read the pixels straight from that block instead of
+receiving a pickled copy, resize the image to every requested size and save
+the results themselves. Only a bounded number of images are decoded and
+waiting at any time, so memory use doesn't grow with the number of inputs.
+
+Every finished output is recorded in a manifest, one JSON object per line,
+along with how long each stage took. Outputs that can't be made, because
+their input can't be decoded, their size is larger than the image or the
+resizing failed, are recorded with the error instead; the other sizes of the
+same input are still made. Inputs are recorded by their absolute path.
+Running the same command again skips the outputs already listed in the
+manifest, and tries the failed ones again, so an interrupted run can be
+resumed, even from another directory:
+
+    python3 batch.py --size 1600 --size 1280x720 --output-dir resized *.jpg
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from resize import retarget_image
+from retarget import build_retargeting_index, retarget_to_width
+from utils import read_image_into_array, write_array_into_image
+
+
+def parse_size(size):
+    """
+    Parse a target size given as 'WIDTH' or 'WIDTHxHEIGHT'. The height is
+    `None` if it's not given, meaning the height of each image is kept.
+    """
+
+    width, _, height = size.partition('x')
+    return (int(width), int(height) if height else None)
+
+
+def format_size(size):
+    width, height = size
+    return str(width) if height is None else f'{width}x{height}'
+
+
+def output_filename_for(input_filename, output_dir, width, height):
+    """
+    The name of the output for an input image at the given size. Inputs with
+    the same name in different directories are told apart by a short hash of
+    their directory.
+    """
+
+    directory, basename = os.path.split(os.path.abspath(input_filename))
+    root, _ = os.path.splitext(basename)
+    tag = hashlib.sha1(directory.encode()).hexdigest()[:8]
+    return os.path.join(output_dir, f'{root}-{tag}-{width}x{height}.png')
+
+
+def check_size(shape, size):
+    """
+    Raise a `ValueError` if an image of the given shape can't be resized to
+    the given (width, height) size, as returned by `parse_size`. Images can
+    only be made smaller, down to a single pixel.
+    """
+
+    h, w = shape[:2]
+    width, height = size
+    if height is None:
+        height = h
+
+    if not (1 <= width <= w and 1 <= height <= h):
+        raise ValueError(
+            f'Cannot resize a {w}x{h} image to {width}x{height}: images can '
+            'only be made smaller'
+        )
+
+
+def read_manifest(filename):
+    """
+    Read the (input, size) pairs already done according to a manifest. Inputs
+    are given by their absolute path.
+    """
+
+    done = set()
+    if not os.path.exists(filename):
+        return done
+
+    with open(filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'error' not in entry:
+                done.add((os.path.abspath(entry['input']), entry['size']))
+
+    return done
+
+
+def resize_to_sizes(pixels, sizes):
+    """
+    Resize an H×W×3 array of pixels to each of the given (width, height)
+    sizes, yielding a tuple for each size, in the same order: the size, with
+    the height filled in, the resized image, and the exception that kept it
+    from being made, if any. Sizes the image can't be resized to (see
+    `check_size`) and sizes whose resizing fails are reported that way,
+    without stopping the others.
+
+    If none of the sizes change the height, the seams are only found once,
+    using a retargeting index, and every width is cut from it. Otherwise each
+    size is resized separately.
+    """
+
+    h, w = pixels.shape[:2]
+
+    errors = []
+    for size in sizes:
+        try:
+            check_size(pixels.shape, size)
+        except ValueError as e:
+            errors.append(e)
+        else:
+            errors.append(None)
+
+    sizes = [
+        (width, h if height is None else height) for width, height in sizes
+    ]
+    valid_sizes = [size for size, error in zip(sizes, errors) if error is None]
+
+    index = None
+    if valid_sizes and all(height == h for _, height in valid_sizes):
+        num_seams_to_remove = w - min(width for width, _ in valid_sizes)
+        index = build_retargeting_index(
+            pixels,
+            num_seams_to_remove,
+            verbose=False
+        )
+
+    for (width, height), error in zip(sizes, errors):
+        if error is not None:
+            yield (width, height), None, error
+            continue
+
+        try:
+            if index is not None:
+                resized_pixels = retarget_to_width(pixels, index, width)
+            else:
+                resized_pixels = retarget_image(pixels, width, height)
+        except Exception as e:
+            yield (width, height), None, e
+        else:
+            yield (width, height), resized_pixels, None
+
+
+def resize_shared_image(
+    shared_memory_name,
+    shape,
+    input_filename,
+    sizes,
+    output_dir
+):
+    """
+    Runs in a worker process: resize the image stored in the given block of
+    shared memory to each of the given sizes and save the results.
+
+    Returns a tuple with two values: a manifest entry for each size, in the
+    same order, and the error that stopped the rest of the sizes from being
+    tried, if any, as a message. The entries of outputs that couldn't be made
+    have an 'error' message instead of an 'output'.
+    """
+
+    block = shared_memory.SharedMemory(name=shared_memory_name)
+
+    entries = []
+    error = None
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=block.buf)
+        _resize_and_save(pixels, input_filename, sizes, output_dir, entries)
+        del pixels
+    except Exception as e:
+        # The traceback would keep the array over the block alive, and the
+        # block can't be closed while it is, so only the message is kept.
+        error = f'{type(e).__name__}: {e}'
+
+    block.close()
+
+    return (entries, error)
+
+
+def _resize_and_save(pixels, input_filename, sizes, output_dir, entries):
+    # Adds each entry as soon as its output is saved, so that those saved
+    # before an error are still known.
+    start = time.perf_counter()
+    for (width, height), resized_pixels, error in \
+            resize_to_sizes(pixels, sizes):
+        resize_seconds = time.perf_counter() - start
+
+        if error is None:
+            output_filename = \
+                output_filename_for(input_filename, output_dir, width, height)
+
+            start = time.perf_counter()
+            try:
+                write_array_into_image(resized_pixels, output_filename)
+            except Exception as e:
+                error = e
+            write_seconds = time.perf_counter() - start
+
+        if error is not None:
+            entries.append({
+                'input': input_filename,
+                'error': f'{type(error).__name__}: {error}',
+            })
+        else:
+            entries.append({
+                'input': input_filename,
+                'output': output_filename,
+                'resize_seconds': resize_seconds,
+                'write_seconds': write_seconds,
+            })
+
+        start = time.perf_counter()
+
+
+def run_batch(
+    input_filenames,
+    sizes,
+    output_dir,
+    manifest_filename,
+    workers=None,
+    max_in_flight=None
+):
+    """
+    Resize every input image to every one of the given sizes (see
+    `parse_size`), saving the results in `output_dir` and recording them in
+    the manifest.
+
+    At most `max_in_flight` images are decoded and waiting for a worker at any
+    time, by default twice the number of workers.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if workers is None:
+        workers = os.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    done = read_manifest(manifest_filename)
+
+    in_flight = {}
+
+    try:
+        with open(manifest_filename, 'a') as manifest, \
+                ProcessPoolExecutor(workers) as executor:
+
+            def record(entry):
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+
+            def record_errors(input_filename, image_sizes, error):
+                print(f'Failed {input_filename}: {error}')
+                for size in image_sizes:
+                    record({
+                        'input': input_filename,
+                        'size': format_size(size),
+                        'error': error,
+                    })
+
+            def finish(futures):
+                for future in futures:
+                    block, input_filename, image_sizes, decode_seconds = \
+                        in_flight.pop(future)
+                    block.close()
+                    block.unlink()
+
+                    try:
+                        entries, error = future.result()
+                    except Exception as e:
+                        entries, error = [], str(e)
+
+                    # The outputs saved before an error are still recorded.
+                    for size, entry in zip(image_sizes, entries):
+                        entry['size'] = format_size(size)
+                        if 'error' in entry:
+                            print(
+                                f'Failed {input_filename} at '
+                                f'{entry["size"]}: {entry["error"]}'
+                            )
+                        else:
+                            entry['decode_seconds'] = decode_seconds
+                        record(entry)
+
+                    if error is not None:
+                        record_errors(
+                            input_filename,
+                            image_sizes[len(entries):],
+                            error
+                        )
+                        continue
+
+                    total = sum(
+                        entry.get('resize_seconds', 0) for entry in entries
+                    )
+                    print(f'Finished {input_filename} in {total:.2f}s')
+
+            for input_filename in input_filenames:
+                input_filename = os.path.abspath(input_filename)
+                image_sizes = [
+                    size for size in sizes
+                    if (input_filename, format_size(size)) not in done
+                ]
+                if not image_sizes:
+                    continue
+
+                while len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    finish(finished)
+
+                start = time.perf_counter()
+                try:
+                    pixels = \
+                        read_image_into_array(input_filename, as_array=True)
+                except Exception as e:
+                    record_errors(
+                        input_filename,
+                        image_sizes,
+                        f'{type(e).__name__}: {e}'
+                    )
+                    continue
+                decode_seconds = time.perf_counter() - start
+
+                block = \
+                    shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+                in_flight_entry = \
+                    (block, input_filename, image_sizes, decode_seconds)
+                try:
+                    np.ndarray(
+                        pixels.shape,
+                        dtype=np.uint8,
+                        buffer=block.buf
+                    )[:] = pixels
+
+                    future = executor.submit(
+                        resize_shared_image,
+                        block.name,
+                        pixels.shape,
+                        input_filename,
+                        image_sizes,
+                        output_dir
+                    )
+                except BaseException:
+                    block.close()
+                    block.unlink()
+                    raise
+                in_flight[future] = in_flight_entry
+
+                del pixels
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                finish(finished)
+    finally:
+        # Only reached with images still in flight if the batch was stopped
+        # by an error. The pool has shut down by then, so no worker is still
+        # reading the blocks.
+        for block, _, _, _ in in_flight.values():
+            block.close()
+            block.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Resize many images to many sizes using seam carving.'
+    )
+    parser.add_argument('inputs', nargs='+', help='images to resize')
+    parser.add_argument(
+        '--size',
+        action='append',
+        required=True,
+        type=parse_size,
+        help='target size, as WIDTH or WIDTHxHEIGHT (can be repeated)'
+    )
+    parser.add_argument('--output-dir', default='resized')
+    parser.add_argument(
+        '--manifest',
+        help='manifest of finished outputs (default: OUTPUT_DIR/manifest.jsonl)'
+    )
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-in-flight', type=int)
+    args = parser.parse_args()
+
+    manifest_filename = args.manifest or \
+        os.path.join(args.output_dir, 'manifest.jsonl')
+
+    run_batch(
+        args.inputs,
+        args.size,
+        args.output_dir,
+        manifest_filename,
+        args.workers,
+        args.max_in_flight
+    )
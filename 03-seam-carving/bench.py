@@ -0,0 +1,535 @@
+"""
+Benchmarks for the seam carving functions, on the sample images and on
+generated images from 64×64 up to 4096×4096 pixels.
+
+Each benchmark is timed (the best of a few runs) and its peak memory measured
+(in a separate run, since tracing memory slows everything down). The pure
+Python versions of the functions are only run on the smaller images, since they
+would take hours on the largest ones. For each benchmark, a scaling curve is
+fitted to the generated images: the time grows roughly as the number of pixels
+raised to the reported exponent.
+
+Results can be saved as a baseline, and later runs compared against it, failing
+if anything got slower or used more memory by more than a threshold:
+
+    python3 bench.py --save-baseline bench-baseline.json
+    python3 bench.py --baseline bench-baseline.json --threshold 0.25
+
+The correctness mode checks the fast array versions of each function against
+the pure Python reference versions, on small generated images and crops of the
+sample images, instead of timing anything:
+
+    python3 bench.py --check
+
+The tiled mode measures how much faster carving wide images gets when the
+seams are searched for on several threads (see `seam_tiled`), for a few
+numbers of workers:
+
+    python3 bench.py --tiled
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from carve import remove_n_lowest_seams_from_image
+from energy import ENERGY_KERNELS, compute_energy
+from seam_v1 import compute_vertical_seam_v1, compute_vertical_seam_v1_streaming
+from seam_v2 import compute_vertical_seam_v2
+from utils import Color, read_image_into_array
+
+
+SAMPLE_IMAGES = ('surfer.jpg', 'arch.jpg')
+SYNTHETIC_SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+
+# The wide images carved by the tiled mode, as (height, width) pairs.
+TILED_SIZES = ((512, 4096), (512, 8192), (512, 16384))
+
+# The pure Python versions are only run on images up to this many pixels.
+MAX_REFERENCE_PIXELS = 256 * 256
+
+
+def synthetic_image(size, seed=0):
+    """
+    Generate a size×size×3 image with smooth gradients, a few flat rectangles
+    and some noise, so that seams have some structure to follow.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    ys, xs = np.mgrid[0:size, 0:size] / max(size - 1, 1)
+    pixels = np.stack((
+        128 + 100 * np.sin(6 * xs + 2 * ys),
+        128 + 100 * np.cos(4 * ys - 3 * xs),
+        255 * xs * ys,
+    ), axis=2)
+
+    for _ in range(4):
+        y0, x0 = rng.integers(0, size, 2)
+        y1, x1 = rng.integers(0, size, 2)
+        pixels[min(y0, y1):max(y0, y1), min(x0, x1):max(x0, x1)] = \
+            rng.integers(0, 256, 3)
+
+    pixels += rng.normal(0, 8, pixels.shape)
+
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def array_to_colors(pixels):
+    return [[Color(*map(int, pixel)) for pixel in row] for row in pixels]
+
+
+def benchmarks(num_seams):
+    """
+    The benchmarks to run, as (name, setup, run, is_reference) tuples. `setup`
+    prepares the input from an H×W×3 array of pixels, outside of the timing,
+    and `run` is what's timed. Reference benchmarks run the pure Python
+    versions, and are skipped on large images.
+    """
+
+    def energy_array(pixels):
+        return compute_energy(pixels)
+
+    def energy_list(pixels):
+        return compute_energy(array_to_colors(pixels))
+
+    def carve(pixels):
+        return remove_n_lowest_seams_from_image(
+            pixels,
+            num_seams,
+            incremental=True,
+            frame_sink='none',
+            verbose=False
+        )
+
+    return [
+        ('energy', lambda pixels: pixels, compute_energy, False),
+        ('energy-reference', array_to_colors, compute_energy, True),
+        ('seam-v1', energy_array, compute_vertical_seam_v1_streaming, False),
+        ('seam-v1-reference', energy_list, compute_vertical_seam_v1, True),
+        ('seam-v2', energy_array, compute_vertical_seam_v2, False),
+        ('seam-v2-reference', energy_list, compute_vertical_seam_v2, True),
+        (f'carve-{num_seams}', lambda pixels: pixels, carve, False),
+    ]
+
+
+def measure(setup, run, pixels, repeat):
+    """
+    Time `run` on the input prepared by `setup`, keeping the best of `repeat`
+    runs, then run it once more while tracing memory. Returns the time in
+    seconds and the peak memory in bytes.
+    """
+
+    data = setup(pixels)
+
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(data)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    try:
+        run(data)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (seconds, peak_memory)
+
+
+def run_benchmarks(images, num_seams, repeat, only=None):
+    """
+    Run every benchmark on every one of the given (name, pixels) images,
+    printing each result as it's done. Returns a list of results, one
+    dictionary per benchmark and image.
+    """
+
+    results = []
+
+    print(f'{"Benchmark":<20} {"Image":<14} {"Pixels":>10} '
+          f'{"Time (s)":>10} {"Peak (MiB)":>11}')
+
+    for image_name, pixels in images:
+        num_pixels = pixels.shape[0] * pixels.shape[1]
+
+        for name, setup, run, is_reference in benchmarks(num_seams):
+            if only is not None and not any(name.startswith(o) for o in only):
+                continue
+            if is_reference and num_pixels > MAX_REFERENCE_PIXELS:
+                continue
+
+            seconds, peak_memory = measure(setup, run, pixels, repeat)
+            results.append({
+                'benchmark': name,
+                'image': image_name,
+                'pixels': num_pixels,
+                'seconds': seconds,
+                'peak_memory': peak_memory,
+            })
+
+            print(
+                f'{name:<20} {image_name:<14} {num_pixels:>10} '
+                f'{seconds:>10.4f} {peak_memory / 2 ** 20:>11.2f}'
+            )
+
+    return results
+
+
+def fit_scaling(results):
+    """
+    For each benchmark run on at least two generated images, fit the time and
+    the peak memory as a power of the number of pixels, returning the exponents
+    by benchmark name.
+    """
+
+    by_benchmark = {}
+    for result in results:
+        if result['image'].startswith('synthetic-'):
+            by_benchmark.setdefault(result['benchmark'], []).append(result)
+
+    scaling = {}
+    for name, runs in by_benchmark.items():
+        if len(runs) < 2:
+            continue
+
+        log_pixels = np.log([run['pixels'] for run in runs])
+        time_exponent, _ = np.polyfit(
+            log_pixels,
+            np.log([max(run['seconds'], 1e-9) for run in runs]),
+            1
+        )
+        memory_exponent, _ = np.polyfit(
+            log_pixels,
+            np.log([max(run['peak_memory'], 1) for run in runs]),
+            1
+        )
+
+        scaling[name] = {
+            'time_exponent': float(time_exponent),
+            'memory_exponent': float(memory_exponent),
+        }
+
+    return scaling
+
+
+def find_regressions(results, baseline, threshold, min_seconds):
+    """
+    Compare results against those of a baseline, returning a description of
+    every benchmark that got slower, or used more memory, by more than the
+    given fraction. Runs faster than `min_seconds` in the baseline are too
+    noisy to compare times on.
+    """
+
+    baseline_results = {
+        (result['benchmark'], result['image']): result
+        for result in baseline['results']
+    }
+
+    regressions = []
+    for result in results:
+        key = (result['benchmark'], result['image'])
+        if key not in baseline_results:
+            continue
+        expected = baseline_results[key]
+
+        if expected['seconds'] >= min_seconds and \
+                result['seconds'] > expected['seconds'] * (1 + threshold):
+            regressions.append(
+                f'{key[0]} on {key[1]}: '
+                f'{expected["seconds"]:.4f}s -> {result["seconds"]:.4f}s'
+            )
+
+        if result['peak_memory'] > expected['peak_memory'] * (1 + threshold):
+            regressions.append(
+                f'{key[0]} on {key[1]}: '
+                f'{expected["peak_memory"]} -> {result["peak_memory"]} bytes'
+            )
+
+    return regressions
+
+
+def check_correctness(images, num_seams):
+    """
+    Check that the fast versions of each function give the same results as
+    the pure Python reference versions on each of the given images. Returns a
+    list of descriptions of the mismatches found.
+    """
+
+    failures = []
+
+    def check(name, image_name, ok):
+        print(f'{"ok" if ok else "FAILED":<8} {name} on {image_name}')
+        if not ok:
+            failures.append(f'{name} on {image_name}')
+
+    for image_name, pixels in images:
+        colors = array_to_colors(pixels)
+
+        for kernel in ENERGY_KERNELS:
+            expected = np.array(compute_energy(colors, kernel))
+            check(
+                f'energy ({kernel})',
+                image_name,
+                np.array_equal(compute_energy(pixels, kernel), expected)
+            )
+
+        energy_array = compute_energy(pixels)
+        energy_list = compute_energy(colors)
+
+        check(
+            'seam-v1',
+            image_name,
+            compute_vertical_seam_v1_streaming(energy_array) ==
+            tuple(compute_vertical_seam_v1(energy_list))
+        )
+
+        seam_xs, seam_energy = compute_vertical_seam_v2(energy_array)
+        expected_seam_xs, expected_energy = compute_vertical_seam_v2(energy_list)
+        check(
+            'seam-v2',
+            image_name,
+            list(seam_xs) == expected_seam_xs and seam_energy == expected_energy
+        )
+
+        seams = min(num_seams, pixels.shape[1] - 1)
+        carved = remove_n_lowest_seams_from_image(
+            pixels,
+            seams,
+            incremental=True,
+            frame_sink='none',
+            verbose=False
+        )
+        expected_carved = remove_n_lowest_seams_from_image(
+            colors,
+            seams,
+            frame_sink='none',
+            verbose=False
+        )
+        check(
+            f'carve-{seams}',
+            image_name,
+            carved.tolist() == [
+                [[color.r, color.g, color.b] for color in row]
+                for row in expected_carved
+            ]
+        )
+
+    return failures
+
+
+def measure_tiled_speedup(sizes, workers_counts, num_seams, repeat):
+    """
+    Time carving `num_seams` seams out of generated images of each of the
+    given (height, width) sizes, first on a single thread and then on each of
+    the given numbers of workers, checking that the results are the same.
+    Returns a list of results, one dictionary per size and number of workers,
+    with the speedup over a single thread.
+    """
+
+    results = []
+
+    print(f'{"Image":<14} {"Workers":>8} {"Time (s)":>10} {"Speedup":>8}')
+
+    for height, width in sizes:
+        # Repeating a square image keeps the generated image cheap to make.
+        pixels = np.tile(synthetic_image(height), (1, -(-width // height), 1))
+        pixels = np.ascontiguousarray(pixels[:, :width])
+        image_name = f'{width}x{height}'
+
+        outputs = {}
+
+        def carve(workers):
+            outputs[workers] = remove_n_lowest_seams_from_image(
+                pixels,
+                num_seams,
+                incremental=True,
+                frame_sink='none',
+                verbose=False,
+                workers=workers
+            ).copy()
+
+        serial_seconds = None
+        for workers in (1,) + tuple(workers_counts):
+            seconds, _ = measure(lambda data: data, carve, workers, repeat)
+            if serial_seconds is None:
+                serial_seconds = seconds
+
+            if not np.array_equal(outputs[workers], outputs[1]):
+                raise RuntimeError(
+                    f'Carving {image_name} on {workers} workers gave a '
+                    'different result'
+                )
+
+            results.append({
+                'image': image_name,
+                'workers': workers,
+                'seconds': seconds,
+                'speedup': serial_seconds / seconds,
+            })
+            print(
+                f'{image_name:<14} {workers:>8} {seconds:>10.4f} '
+                f'{serial_seconds / seconds:>7.2f}x'
+            )
+
+    return results
+
+
+def load_images(sizes, samples=True, crop=None):
+    """
+    The sample images, if requested, followed by a generated image of each of
+    the given sizes. Sample images are cropped to crop×crop pixels if `crop`
+    is given.
+    """
+
+    images = []
+
+    if samples:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for filename in SAMPLE_IMAGES:
+            pixels = read_image_into_array(
+                os.path.join(directory, filename),
+                as_array=True
+            )
+            if crop is not None:
+                pixels = pixels[:crop, :crop]
+            images.append((filename, pixels))
+
+    for size in sizes:
+        images.append((f'synthetic-{size}', synthetic_image(size)))
+
+    return images
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the seam carving functions.'
+    )
+    parser.add_argument(
+        '--max-size',
+        type=int,
+        default=SYNTHETIC_SIZES[-1],
+        help='largest generated image to benchmark (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--no-samples',
+        action='store_true',
+        help="don't benchmark the sample images"
+    )
+    parser.add_argument(
+        '--only',
+        action='append',
+        help='only run benchmarks whose name starts with this (can be repeated)'
+    )
+    parser.add_argument('--seams', type=int, default=5,
+                        help='seams removed by the carve benchmark')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs to keep the best time of')
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--save-baseline', help='save the results as a baseline')
+    parser.add_argument('--baseline', help='compare against a saved baseline')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.25,
+        help='fraction by which a benchmark may regress (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--min-seconds',
+        type=float,
+        default=0.005,
+        help='baseline times below this are not compared (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='check the fast versions against the reference versions instead'
+    )
+    parser.add_argument(
+        '--tiled',
+        action='store_true',
+        help='measure the speedup of carving wide images on several threads'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        action='append',
+        help='numbers of workers for --tiled (default: 2, 4 and one per core)'
+    )
+    args = parser.parse_args()
+
+    if args.tiled:
+        workers_counts = args.workers or \
+            sorted({2, 4, os.cpu_count()} - {1})
+        results = measure_tiled_speedup(
+            TILED_SIZES,
+            workers_counts,
+            args.seams,
+            args.repeat
+        )
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump({'tiled': results}, f, indent=2)
+            print(f'Saved {args.output}')
+        sys.exit(0)
+
+    if args.check:
+        images = load_images((1, 2, 7, 33, 64), not args.no_samples, crop=48)
+        # Images with a single row or column are edge cases of their own.
+        images.append(('synthetic-1x40', synthetic_image(40)[:1]))
+        images.append(('synthetic-40x1', synthetic_image(40)[:, :1]))
+
+        failures = check_correctness(images, args.seams)
+        if failures:
+            print()
+            print(f'{len(failures)} mismatches')
+            sys.exit(1)
+        sys.exit(0)
+
+    sizes = [size for size in SYNTHETIC_SIZES if size <= args.max_size]
+    images = load_images(sizes, not args.no_samples)
+
+    results = run_benchmarks(images, args.seams, args.repeat, args.only)
+    scaling = fit_scaling(results)
+
+    print()
+    print(f'{"Benchmark":<20} {"Time exponent":>14} {"Memory exponent":>16}')
+    for name, exponents in scaling.items():
+        print(
+            f'{name:<20} '
+            f'{exponents["time_exponent"]:>14.2f} '
+            f'{exponents["memory_exponent"]:>16.2f}'
+        )
+
+    report = {'results': results, 'scaling': scaling}
+    for filename in (args.output, args.save_baseline):
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f'Saved {filename}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = find_regressions(
+            results,
+            baseline,
+            args.threshold,
+            args.min_seconds
+        )
+
+        print()
+        if regressions:
+            print(f'{len(regressions)} regressions against {args.baseline}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+
+        print(f'No regressions against {args.baseline}')
@@ -12,9 +12,25 @@ resize your image!
 
 import sys
 
-from energy import compute_energy
-from seam_v2 import compute_vertical_seam_v2, visualize_seam_on_image
-from utils import Color, read_image_into_array, write_array_into_image
+import numpy as np
+
+from energy import (
+    compute_energy,
+    compute_energy_at,
+    get_energy_kernel,
+    positions_next_to_seam,
+)
+from frames import make_frame_sink
+from profiling import NULL_PROFILER
+from seam_v2 import compute_vertical_seam_v2
+from utils import (
+    Color,
+    ColorGrid,
+    as_pixel_array,
+    read_image_into_array,
+    write_array_into_image,
+)
+from workspace import CarvingWorkspace
 
 
 def remove_seam_from_image(image, seam_xs):
@@ -26,8 +42,19 @@ def remove_seam_from_image(image, seam_xs):
     This is one of the functions you will need to implement. Expected return
     value: the 2D grid of colors. The grid will be smaller than the input by
     one element in each row, but will have the same number of rows.
+
+    If the image is an H×W×3 array (or a `ColorGrid` over one), the seam is
+    removed with a single masked copy instead of one `pop` per row.
     """
-    # img_arr = read_image_into_array(image)
+
+    if isinstance(image, ColorGrid):
+        return ColorGrid(remove_seam_from_image(image.array, seam_xs))
+
+    if isinstance(image, np.ndarray):
+        h, w = image.shape[:2]
+        keep = np.ones((h, w), dtype=bool)
+        keep[np.arange(h), seam_xs] = False
+        return image[keep].reshape((h, w - 1) + image.shape[2:])
 
     for line, x_to_remove in zip(image, seam_xs):
         line.pop(x_to_remove)
@@ -35,7 +62,61 @@ def remove_seam_from_image(image, seam_xs):
     return image
 
 
-def remove_n_lowest_seams_from_image(image, num_seams_to_remove):
+def update_energy_after_seam_removal(
+    image,
+    energy_data,
+    seam_xs,
+    kernel='gradient'
+):
+    """
+    Update the energy grid of an image from which the given seam has just been
+    removed, without recomputing the whole grid. The image is the one after
+    removal, while the energy grid still has the seam in it.
+
+    The seam's cells are removed from the energy grid. Then, in each row, only
+    the pixels that ended up next to the removed pixel are recomputed: every
+    other pixel has the same horizontal neighbors as before, and because
+    neighboring seam pixels are at most one column apart, the same vertical
+    neighbors too. Kernels looking further than the direct neighbors need a
+    wider band around the seam (see `positions_next_to_seam`).
+
+    Returns the updated energy grid, which is identical to calling
+    `compute_energy` on the new image with the same kernel.
+    """
+
+    kernel = get_energy_kernel(kernel)
+
+    energy_data = remove_seam_from_image(energy_data, seam_xs)
+
+    array = as_pixel_array(image)
+    if array is not None:
+        w = energy_data.shape[1]
+        ys, xs = positions_next_to_seam(seam_xs, w, kernel.radius)
+
+        energy_data[ys, xs] = compute_energy_at(array, ys, xs, kernel)
+        return energy_data
+
+    w = len(energy_data[0])
+    ys, xs = positions_next_to_seam(seam_xs, w, kernel.radius)
+    for y, x in zip(ys.tolist(), xs.tolist()):
+        energy_data[y][x] = kernel.compute_at(image, x, y)
+
+    return energy_data
+
+
+def remove_n_lowest_seams_from_image(
+    image,
+    num_seams_to_remove,
+    incremental=False,
+    check_incremental_energy=False,
+    frame_sink='png',
+    on_seam_removed=None,
+    horizontal=False,
+    energy='gradient',
+    profiler=NULL_PROFILER,
+    verbose=True,
+    workers=1
+):
     """
     Iteratively:
 
@@ -47,8 +128,40 @@ def remove_n_lowest_seams_from_image(image, num_seams_to_remove):
 
     While not necessary, you may want to save the intermediate images in the
     process, in case you want to see how the image gets progressively smaller.
-    The `visualize_seam_on_image` is available if you want to visualize the
-    lowest-energy seam at each step of the process.
+    The `visualize_seam_on_image` function in `seam_v2` is available if you want
+    to visualize the lowest-energy seam at each step of the process.
+
+    If `incremental` is set, the energy is only computed in full once. After
+    that, the energy grid is kept between iterations and only updated around
+    each removed seam (see `update_energy_after_seam_removal`). Setting
+    `check_incremental_energy` compares each update against a full recompute,
+    raising a `RuntimeError` if they differ, which is useful for debugging but
+    gives up the speedup.
+
+    If the image is an H×W×3 array (or a `ColorGrid` over one), the seams are
+    removed within a `CarvingWorkspace`, allocating memory once for the whole
+    process. The result is then a view into that workspace. Setting
+    `horizontal` removes horizontal seams instead, which the workspace does
+    on a transposed view of the image, without copying it. Horizontal seams
+    are only supported for arrays. The workspace searches for the seams of
+    wide images on `workers` threads, as described in `CarvingWorkspace`; by
+    default, it uses a single one.
+
+    The energy is measured by the kernel named by `energy` (see `compute_energy`
+    in the `energy` module). Kernels with transition costs, such as 'forward',
+    are only supported for arrays, since the costs are added by the array seam
+    search.
+
+    Progress is printed for every seam, unless `verbose` is turned off. The
+    time spent in each stage, including those of the frame sink, is recorded
+    by `profiler`, such as a `StageProfiler` from the `profiling` module.
+
+    Intermediate images are handed to `frame_sink`, either a sink from the
+    `frames` module or a description accepted by `make_frame_sink`. By
+    default, each one is saved as a PNG on a background thread, which this
+    function waits for before returning. Use 'none' to skip them. If
+    `on_seam_removed` is given, it's called after each removal with the
+    iteration number, the x-coordinates of the removed seam and its energy.
 
     This is one of the functions you will need to implement. Expected return
     value: the 2D grid of colors. The grid will be smaller than the input by
@@ -56,24 +169,97 @@ def remove_n_lowest_seams_from_image(image, num_seams_to_remove):
     rows.
     """
 
-    for i in range(num_seams_to_remove):
-        print(f'Removing seam {i + 1}/{num_seams_to_remove}')
+    return_color_grid = isinstance(image, ColorGrid)
+    kernel = get_energy_kernel(energy)
+
+    array = as_pixel_array(image)
+    if array is not None:
+        workspace = CarvingWorkspace(array, kernel, profiler, workers)
+    elif horizontal:
+        raise ValueError('Horizontal seams can only be removed from arrays')
+    elif kernel.has_transition_costs:
+        raise ValueError(
+            f'The {kernel.name} energy kernel can only be used with arrays'
+        )
+
+    log = print if verbose else _ignore
+
+    frame_sink = make_frame_sink(frame_sink)
+    frame_sink.start(image, profiler)
 
-        print('  Computing energy...')
-        energy_data = compute_energy(image)
-        print('  Finding the lowest-energy seam...')
-        seam_xs, _ = compute_vertical_seam_v2(energy_data)
+    energy_data = None
 
-        print(f'  Saving intermediate result to intermediate-{i}.png...')
-        visualized_pixels = visualize_seam_on_image(image, seam_xs)
-        write_array_into_image(visualized_pixels, f'intermediate-{i}.png')
+    try:
+        for i in range(num_seams_to_remove):
+            log(f'Removing seam {i + 1}/{num_seams_to_remove}')
+            profiler.iteration = i
 
-        print('  Removing the lowest-energy seam...')
-        image = remove_seam_from_image(image, seam_xs)
+            if energy_data is None:
+                log('  Computing energy...')
+                if array is not None:
+                    energy_data = workspace.compute_energy()
+                else:
+                    with profiler.stage('energy'):
+                        energy_data = compute_energy(image, kernel)
+            log('  Finding the lowest-energy seam...')
+            if array is not None:
+                seam_xs, seam_energy = workspace.find_seam(horizontal)
+            else:
+                # The list version backtracks as part of the same function, so
+                # it is all recorded as 'dp'.
+                with profiler.stage('dp'):
+                    seam_xs, seam_energy = compute_vertical_seam_v2(energy_data)
 
+            frame_sink.add_seam(i, seam_xs, horizontal)
+
+            log('  Removing the lowest-energy seam...')
+            if array is not None:
+                workspace.remove_seam(seam_xs, incremental, horizontal)
+                image = workspace.pixels
+            else:
+                with profiler.stage('removal'):
+                    image = remove_seam_from_image(image, seam_xs)
+
+            if on_seam_removed is not None:
+                on_seam_removed(i, seam_xs, seam_energy)
+
+            if not incremental:
+                energy_data = None
+                continue
+
+            log('  Updating energy around the removed seam...')
+            if array is not None:
+                energy_data = workspace.energy
+            else:
+                with profiler.stage('energy'):
+                    energy_data = update_energy_after_seam_removal(
+                        image,
+                        energy_data,
+                        seam_xs,
+                        kernel
+                    )
+
+            if check_incremental_energy:
+                expected_energy_data = compute_energy(image, kernel)
+                if not np.array_equal(energy_data, expected_energy_data):
+                    raise RuntimeError(
+                        'Incremental energy differs from a full recompute at '
+                        f'seam {i}'
+                    )
+    finally:
+        frame_sink.close()
+        if array is not None:
+            workspace.close()
+
+    if isinstance(image, np.ndarray) and return_color_grid:
+        return ColorGrid(image)
     return image
 
 
+def _ignore(*args):
+    pass
+
+
 if __name__ == '__main__':
     # 1063922
 
@@ -86,9 +272,12 @@ if __name__ == '__main__':
     output_filename = "resized.png"
 
     print(f'Reading {input_filename}...')
-    pixels = read_image_into_array(input_filename)
+    pixels = read_image_into_array(input_filename, as_array=True)
 
     print(f'Saving {output_filename}')
-    resized_pixels = \
-        remove_n_lowest_seams_from_image(pixels, num_seams_to_remove)
+    resized_pixels = remove_n_lowest_seams_from_image(
+        pixels,
+        num_seams_to_remove,
+        incremental=True
+    )
     write_array_into_image(resized_pixels, output_filename)
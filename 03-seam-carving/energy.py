@@ -7,12 +7,24 @@ image will be visualized as a grayscale heat map, with brighter spots
 representing pixels:
 
     python3 energy.py surfer.jpg surfer-energy.png
+
+Other energy kernels, such as 'sobel', 'dual-gradient' or 'forward', can be
+selected by name (see `ENERGY_KERNELS`):
+
+    python3 energy.py surfer.jpg surfer-energy-sobel.png sobel
 """
 
+import math
 import sys
-import copy
 
-from utils import Color, read_image_into_array, write_array_into_image
+import numpy as np
+
+from utils import (
+    Color,
+    as_pixel_array,
+    read_image_into_array,
+    write_array_into_image,
+)
 
 
 def energy_at(pixels, x, y):
@@ -50,7 +62,246 @@ def energy_at(pixels, x, y):
     return dx + dy
 
 
-def compute_energy(pixels):
+class EnergyKernel:
+    """
+    A way of measuring the energy of an image, registered under a name that
+    the rest of the seam carving code can select it by. Each kernel comes in
+    two versions, which give the same results:
+
+      - `compute`, which takes a batch of pixel arrays of shape (..., H, W, 3),
+        already padded by `radius` pixels on every side by repeating the
+        border pixels, and returns the (..., H, W) energies at once.
+      - `compute_at`, a reference version taking a 2D list of colors and a
+        single (x, y) position, like `energy_at`.
+
+    The energy at a position only depends on the pixels at most `radius`
+    positions away from it. `dtype` is the type of the values returned by
+    `compute`, and `symmetric` is set if transposing the image transposes its
+    energies, so that horizontal seams can use the same energies.
+
+    Some kernels, such as forward energy, also add a cost to each step of a
+    seam depending on whether it goes down to the left, straight down or down
+    to the right. Those kernels have a `transition_costs_row(pixels, y)`
+    function, returning two arrays: the extra costs of reaching each position
+    in row `y` from the position above and to the left of it, and from the one
+    above and to the right. `transition_costs_at(pixels, x, y)` is the
+    reference version, returning the same two costs for a single position.
+
+    Kernels can also have a `compute_into(padded, out, scratch)` function,
+    which writes the energies of a single padded image into `out` instead of
+    allocating them, using `scratch`, an array of 32-bit integers of the same
+    shape as `out`, for its temporary values. `compute_energy_array` uses it
+    when it's given buffers to work in.
+    """
+
+    def __init__(
+        self,
+        name,
+        compute,
+        compute_at,
+        radius=1,
+        dtype=np.int32,
+        symmetric=True,
+        transition_costs_row=None,
+        transition_costs_at=None,
+        compute_into=None
+    ):
+        self.name = name
+        self.compute = compute
+        self.compute_at = compute_at
+        self.radius = radius
+        self.dtype = dtype
+        self.symmetric = symmetric
+        self.transition_costs_row = transition_costs_row
+        self.transition_costs_at = transition_costs_at
+        self.compute_into = compute_into
+
+    @property
+    def has_transition_costs(self):
+        return self.transition_costs_row is not None
+
+
+ENERGY_KERNELS = {}
+
+
+def register_energy_kernel(kernel):
+    """
+    Make an `EnergyKernel` available by its name.
+    """
+
+    ENERGY_KERNELS[kernel.name] = kernel
+    return kernel
+
+
+def get_energy_kernel(kernel):
+    """
+    Look up an energy kernel by name. Kernels that are already `EnergyKernel`
+    objects are returned as they are.
+    """
+
+    if isinstance(kernel, EnergyKernel):
+        return kernel
+
+    try:
+        return ENERGY_KERNELS[kernel]
+    except KeyError:
+        names = ', '.join(sorted(ENERGY_KERNELS))
+        raise ValueError(f'Unknown energy kernel: {kernel} (known: {names})')
+
+
+def _clamped_pixel_at(pixels, x, y):
+    h = len(pixels)
+    w = len(pixels[0])
+    return pixels[min(max(y, 0), h - 1)][min(max(x, 0), w - 1)]
+
+
+def _color_difference(a, b):
+    return abs(a.r - b.r) + abs(a.g - b.g) + abs(a.b - b.b)
+
+
+def _gradient_energy(padded):
+    shape = padded.shape[:-3] + (padded.shape[-3] - 2, padded.shape[-2] - 2)
+    energy = np.empty(shape, dtype=np.int32)
+    _gradient_energy_into(padded, energy, np.empty(shape, dtype=np.int32))
+    return energy
+
+
+def _gradient_energy_into(padded, out, scratch):
+    out[...] = 0
+
+    # Each color channel is processed separately, and every difference is
+    # computed in the same scratch array, so nothing else is allocated.
+    for c in range(padded.shape[-1]):
+        channel = padded[..., c]
+
+        np.subtract(
+            channel[..., 1:-1, :-2],
+            channel[..., 1:-1, 2:],
+            out=scratch,
+            dtype=np.int32
+        )
+        np.multiply(scratch, scratch, out=scratch)
+        out += scratch
+
+        np.subtract(
+            channel[..., :-2, 1:-1],
+            channel[..., 2:, 1:-1],
+            out=scratch,
+            dtype=np.int32
+        )
+        np.multiply(scratch, scratch, out=scratch)
+        out += scratch
+
+
+def _dual_gradient_energy(padded):
+    return np.sqrt(_gradient_energy(padded))
+
+
+def _dual_gradient_energy_at(pixels, x, y):
+    return math.sqrt(energy_at(pixels, x, y))
+
+
+def _sobel_energy(padded):
+    energy = np.zeros(padded.shape[:-3] + (
+        padded.shape[-3] - 2,
+        padded.shape[-2] - 2
+    ), dtype=np.int32)
+
+    for c in range(padded.shape[-1]):
+        channel = padded[..., c].astype(np.int32)
+
+        left = channel[..., :-2, :-2] + 2 * channel[..., 1:-1, :-2] + \
+            channel[..., 2:, :-2]
+        right = channel[..., :-2, 2:] + 2 * channel[..., 1:-1, 2:] + \
+            channel[..., 2:, 2:]
+        gx = right - left
+
+        top = channel[..., :-2, :-2] + 2 * channel[..., :-2, 1:-1] + \
+            channel[..., :-2, 2:]
+        bottom = channel[..., 2:, :-2] + 2 * channel[..., 2:, 1:-1] + \
+            channel[..., 2:, 2:]
+        gy = bottom - top
+
+        energy += gx * gx + gy * gy
+
+    return energy
+
+
+def _sobel_energy_at(pixels, x, y):
+    def at(dx, dy, channel):
+        return getattr(_clamped_pixel_at(pixels, x + dx, y + dy), channel)
+
+    energy = 0
+    for channel in ('r', 'g', 'b'):
+        gx = 0
+        gy = 0
+        for d, weight in ((-1, 1), (0, 2), (1, 1)):
+            gx += weight * (at(1, d, channel) - at(-1, d, channel))
+            gy += weight * (at(d, 1, channel) - at(d, -1, channel))
+
+        energy += gx * gx + gy * gy
+
+    return energy
+
+
+def _forward_energy(padded):
+    # The cost of removing a pixel is that of the new edge it creates between
+    # its left and right neighbors. The costs of the edges created with the
+    # row above depend on the direction of the seam, and are added by the seam
+    # search through `transition_costs_row`.
+    d = padded[..., 1:-1, :-2, :].astype(np.int32) - padded[..., 1:-1, 2:, :]
+    return np.abs(d).sum(axis=-1, dtype=np.int32)
+
+
+def _forward_energy_at(pixels, x, y):
+    return _color_difference(
+        _clamped_pixel_at(pixels, x - 1, y),
+        _clamped_pixel_at(pixels, x + 1, y)
+    )
+
+
+def _forward_transition_costs_row(pixels, y):
+    above = pixels[max(y - 1, 0)].astype(np.int32)
+    row = np.pad(pixels[y], ((1, 1), (0, 0)), mode='edge')
+
+    left = np.abs(above - row[:-2]).sum(axis=-1, dtype=np.int32)
+    right = np.abs(above - row[2:]).sum(axis=-1, dtype=np.int32)
+
+    return (left, right)
+
+
+def _forward_transition_costs_at(pixels, x, y):
+    above = _clamped_pixel_at(pixels, x, y - 1)
+    return (
+        _color_difference(above, _clamped_pixel_at(pixels, x - 1, y)),
+        _color_difference(above, _clamped_pixel_at(pixels, x + 1, y))
+    )
+
+
+register_energy_kernel(EnergyKernel(
+    'gradient',
+    _gradient_energy,
+    energy_at,
+    compute_into=_gradient_energy_into
+))
+register_energy_kernel(EnergyKernel(
+    'dual-gradient',
+    _dual_gradient_energy,
+    _dual_gradient_energy_at,
+    dtype=np.float64
+))
+register_energy_kernel(EnergyKernel('sobel', _sobel_energy, _sobel_energy_at))
+register_energy_kernel(EnergyKernel(
+    'forward',
+    _forward_energy,
+    _forward_energy_at,
+    symmetric=False,
+    transition_costs_row=_forward_transition_costs_row,
+    transition_costs_at=_forward_transition_costs_at
+))
+
+
+def compute_energy(pixels, kernel='gradient'):
     """
     Compute the energy of the image at every pixel. Should use the `energy_at`
     function to actually compute the energy at any single position.
@@ -61,20 +312,208 @@ def compute_energy(pixels):
 
     This is one of the functions you will need to implement. Expected return
     value: the 2D grid of energy values.
+
+    If the pixels are an H×W×3 array (or a `ColorGrid` over one), the energy is
+    computed for the whole image at once by `compute_energy_array`, and is
+    returned as an H×W array instead.
+
+    Other ways of measuring the energy can be selected by the name of their
+    kernel, such as 'sobel', 'dual-gradient' or 'forward' (see
+    `ENERGY_KERNELS`). The default, 'gradient', is `energy_at`.
     """
 
+    kernel = get_energy_kernel(kernel)
+
+    array = as_pixel_array(pixels)
+    if array is not None:
+        return compute_energy_array(array, kernel)
+
     h = len(pixels)
     w = len(pixels[0])
 
-    energy_grid = copy.deepcopy(pixels)
+    energy_grid = [[0] * w for _ in range(h)]
 
     for y in range(h):
         for x in range(w):
-            energy_grid[y][x] = energy_at(pixels, x, y)
+            energy_grid[y][x] = kernel.compute_at(pixels, x, y)
 
     return energy_grid
 
 
+def compute_energy_array(
+    pixels,
+    kernel='gradient',
+    out=None,
+    padded=None,
+    scratch=None
+):
+    """
+    Compute the energy of an H×W×3 array of pixels at every position at once,
+    returning an H×W array (of 32-bit integers for the default kernel).
+
+    The result is identical to calling `energy_at`, or the `compute_at`
+    function of the kernel, at every position. Padding the image by repeating
+    its border pixels reproduces the edge rule used there, since a missing
+    neighbor is replaced by the nearest position inside the image.
+
+    To compute the energy of many images without allocating memory for each
+    one, buffers can be passed in: `out`, for the energies, `padded`, an array
+    of the same type as the pixels and `radius` positions larger on every
+    side, and `scratch`, an H×W array of 32-bit integers. The energies are
+    written into `out`, which is returned. Kernels without a `compute_into`
+    function ignore `scratch`, and still allocate their result before it's
+    copied into `out`.
+    """
+
+    kernel = get_energy_kernel(kernel)
+    r = kernel.radius
+
+    if padded is None:
+        padded = np.pad(pixels, ((r, r), (r, r), (0, 0)), mode='edge')
+    else:
+        pad_edges_into(pixels, r, padded)
+
+    if out is None:
+        return kernel.compute(padded)
+
+    if kernel.compute_into is not None and scratch is not None:
+        kernel.compute_into(padded, out, scratch)
+    else:
+        out[...] = kernel.compute(padded)
+    return out
+
+
+def pad_edges_into(pixels, radius, padded):
+    """
+    Copy an H×W×3 array of pixels into the middle of `padded`, an array
+    `radius` positions larger on every side, and fill the border by repeating
+    the pixels at the edges of the image, like `np.pad` with mode 'edge'.
+    """
+
+    h, w = pixels.shape[:2]
+    r = radius
+
+    padded[r:r + h, r:r + w] = pixels
+    padded[:r, r:r + w] = pixels[:1]
+    padded[r + h:, r:r + w] = pixels[-1:]
+    padded[:, :r] = padded[:, r:r + 1]
+    padded[:, r + w:] = padded[:, r + w - 1:r + w]
+
+
+def compute_energy_at(pixels, ys, xs, kernel='gradient'):
+    """
+    Compute the energy of an H×W×3 array of pixels at each of the given
+    positions, returning one value per position. `ys` and `xs` are arrays of
+    the same length.
+
+    This is `energy_at` applied to many positions at once, and is used to
+    update only the parts of an energy grid that changed. The neighborhood of
+    every position is gathered into a batch, with the same edge rule as
+    `compute_energy_array`, and handed to the kernel all at once.
+    """
+
+    kernel = get_energy_kernel(kernel)
+    r = kernel.radius
+    h, w = pixels.shape[:2]
+
+    offsets = np.arange(-r, r + 1)
+    patch_ys = np.clip(np.asarray(ys)[:, np.newaxis] + offsets, 0, h - 1)
+    patch_xs = np.clip(np.asarray(xs)[:, np.newaxis] + offsets, 0, w - 1)
+    patches = pixels[patch_ys[:, :, np.newaxis], patch_xs[:, np.newaxis, :]]
+
+    return kernel.compute(patches)[:, 0, 0]
+
+
+def positions_next_to_seam(seam_xs, width, radius=1):
+    """
+    Given the x-coordinates of a vertical seam that was just removed, one per
+    row, and the width of the image after removing it, return the (ys, xs)
+    positions whose energy may have changed, for a kernel of the given radius.
+
+    A position keeps its energy if all of its neighbors within `radius` rows
+    are on the same side of the seam, so only those within `radius` columns of
+    the seam in any of those rows need to be recomputed. The same position may
+    be returned more than once.
+    """
+
+    seam_xs = np.asarray(seam_xs)
+    h = seam_xs.shape[0]
+
+    padded = np.pad(seam_xs, radius, mode='edge')
+    lowest = padded[:h].copy()
+    for dy in range(1, 2 * radius + 1):
+        np.minimum(lowest, padded[dy:dy + h], out=lowest)
+
+    # Within 2 * radius + 1 rows, a seam moves by at most 2 * radius columns,
+    # so 4 * radius columns starting at `lowest - radius` cover every position
+    # that may have changed.
+    xs = (lowest[:, np.newaxis] - radius + np.arange(4 * radius)).ravel()
+    ys = np.repeat(np.arange(h), 4 * radius)
+
+    return (ys, np.clip(xs, 0, width - 1))
+
+
+def iter_energy_rows(scanlines):
+    """
+    Compute the energy of an image one row at a time, given the image as an
+    iterable of W×3 rows of pixels, from top to bottom. Yields one row of
+    32-bit integer energies for each row of pixels.
+
+    Only three rows of pixels are held at any point, so the image can come
+    from a generator without ever being loaded in full. The results are the
+    same as the rows of `compute_energy_array`.
+    """
+
+    scanlines = iter(scanlines)
+
+    current = next(scanlines, None)
+    above = current
+    below = next(scanlines, None)
+
+    while current is not None:
+        yield _energy_of_row(
+            above,
+            current,
+            current if below is None else below
+        )
+
+        above, current, below = current, below, next(scanlines, None)
+
+
+def _energy_of_row(above, current, below):
+    padded = np.pad(current.astype(np.int32), ((1, 1), (0, 0)), mode='edge')
+    d = padded[:-2] - padded[2:]
+    dx = (d * d).sum(axis=1, dtype=np.int32)
+
+    d = above.astype(np.int32) - below
+    dy = (d * d).sum(axis=1, dtype=np.int32)
+
+    return dx + dy
+
+
+def write_energy_rows(energy_rows, filename):
+    """
+    Write rows of energy values to a raw file, one after the other, without
+    any header. The file can be read back with `read_energy_rows`.
+    """
+
+    with open(filename, 'wb') as f:
+        for energy_row in energy_rows:
+            np.asarray(energy_row, dtype=np.int32).tofile(f)
+
+
+def read_energy_rows(filename, width, dtype=np.int32):
+    """
+    Memory-map a raw file of energy values written by `write_energy_rows` and
+    yield it one row at a time. Rows are only paged in from disk as they are
+    used.
+    """
+
+    energy_data = np.memmap(filename, dtype=dtype, mode='r').reshape(-1, width)
+    for energy_row in energy_data:
+        yield energy_row
+
+
 def energy_data_to_colors(energy_data):
     """
     Convert the energy values at each pixel into colors that can be used to
@@ -87,6 +526,11 @@ def energy_data_to_colors(energy_data):
     This is NOT one of the functions you have to implement.
     """
 
+    if isinstance(energy_data, np.ndarray):
+        normalized = np.round(energy_data / energy_data.max() * 255)
+        gray = normalized.astype(np.uint8)[:, :, np.newaxis]
+        return np.repeat(gray, 3, axis=2)
+
     colors = [[0 for _ in row] for row in energy_data]
 
     max_energy = max(
@@ -108,18 +552,19 @@ def energy_data_to_colors(energy_data):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print(f'USAGE: {__file__} <input> <output>')
+    if len(sys.argv) not in (3, 4):
+        print(f'USAGE: {__file__} <input> <output> [<kernel>]')
         sys.exit(1)
 
     input_filename = sys.argv[1]
     output_filename = sys.argv[2]
+    kernel = sys.argv[3] if len(sys.argv) == 4 else 'gradient'
 
     print(f'Reading {input_filename}...')
-    pixels = read_image_into_array(input_filename)
+    pixels = read_image_into_array(input_filename, as_array=True)
 
     print('Computing the energy...')
-    energy_data = compute_energy(pixels)
+    energy_data = compute_energy(pixels, kernel)
     energy_pixels = energy_data_to_colors(energy_data)
 
     print(f'Saving {output_filename}')
@@ -0,0 +1,92 @@
+"""
+Making an image wider by inserting seams, instead of removing them.
+
+Inserting the lowest-energy seam one at a time doesn't work, since duplicating
+it creates a new lowest-energy seam right next to it, and the same area would
+be stretched over and over. Instead, the seams that would be removed to make
+the image narrower by the same amount are found first. Then, next to each
+pixel of those seams, a new pixel averaging it with its right neighbor is
+inserted into the original image, all in one pass.
+
+    python3 enlarge.py surfer.jpg 100 surfer-enlarged.png
+"""
+
+import sys
+
+import numpy as np
+
+from retarget import build_retargeting_index
+from utils import read_image_into_array, write_array_into_image
+
+
+def duplicate_seams(pixels, seam_mask):
+    """
+    Given an H×W×3 array of pixels and an H×W boolean array marking the same
+    number of pixels in each row, insert a new pixel after each marked pixel.
+    The new pixel is the average of the marked pixel and the one to its right.
+    """
+
+    h, w = pixels.shape[:2]
+    num_seams = int(np.count_nonzero(seam_mask[0]))
+
+    right = np.concatenate((pixels[:, 1:], pixels[:, -1:]), axis=1)
+    averaged = (pixels.astype(np.uint16) + right + 1) // 2
+
+    # Each pixel is followed by its averaged copy, which is only kept for the
+    # marked pixels.
+    candidates = np.stack((pixels, averaged.astype(pixels.dtype)), axis=2)
+    keep = np.stack((np.ones_like(seam_mask), seam_mask), axis=2)
+
+    return candidates[keep].reshape((h, w + num_seams) + pixels.shape[2:])
+
+
+def insert_n_seams_into_image(pixels, num_seams_to_insert, verbose=True):
+    """
+    Make the given H×W×3 array of pixels wider by `num_seams_to_insert`
+    pixels, by duplicating low-energy seams.
+
+    The seams to duplicate are planned with `build_retargeting_index`, which
+    removes them from a working copy of the image while keeping track of where
+    each of their pixels was in the original image. At most half the width of
+    the image is inserted at once, so larger enlargements happen in several
+    rounds, planned on the result of the previous round. Seams can only be
+    planned on images at least 2 pixels wide.
+
+    Progress is printed for every planned seam, unless `verbose` is turned
+    off.
+    """
+
+    if num_seams_to_insert > 0 and pixels.shape[1] < 2:
+        raise ValueError(
+            'Seams can only be inserted into images at least 2 pixels wide'
+        )
+
+    num_seams_left = num_seams_to_insert
+
+    while num_seams_left > 0:
+        num_seams = min(num_seams_left, pixels.shape[1] // 2)
+
+        index = build_retargeting_index(pixels, num_seams, verbose)
+        pixels = duplicate_seams(pixels, index < num_seams)
+
+        num_seams_left -= num_seams
+
+    return pixels
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print(f'USAGE: {__file__} <input> <num-seams-to-insert> <output>')
+        sys.exit(1)
+
+    input_filename = sys.argv[1]
+    num_seams_to_insert = int(sys.argv[2])
+    output_filename = sys.argv[3]
+
+    print(f'Reading {input_filename}...')
+    pixels = read_image_into_array(input_filename, as_array=True)
+
+    enlarged_pixels = insert_n_seams_into_image(pixels, num_seams_to_insert)
+
+    print(f'Saving {output_filename}')
+    write_array_into_image(enlarged_pixels, output_filename)
@@ -0,0 +1,263 @@
+"""
+Outputs for the intermediate results of the seam carving process. A frame sink
+is handed each seam as it's removed, and decides what to do with it, if
+anything: saving every intermediate image, only some of them, a single
+animation, or just the seams themselves.
+
+Sinks that write images do so on a background thread. The carving process only
+hands over the x-coordinates of each seam, and the thread keeps its own copy of
+the image, removing the same seams from it, so the process never waits on
+image encoding or on the disk.
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+from PIL import Image
+
+from profiling import NULL_PROFILER
+from seam_v2 import visualize_seam_on_image
+from utils import as_pixel_array, colors_to_array, write_array_into_image
+from workspace import PixelBuffer
+
+
+class FrameSink:
+    """
+    A frame sink that does nothing. Other sinks override:
+
+      - `start`, called with the original image before any seam is removed,
+        along with the profiler recording the stages of the carving process
+        (see the `profiling` module). Sinks record their own stages with it.
+      - `add_seam`, called with the iteration number and the coordinates of
+        each seam, before it's removed. For horizontal seams, `horizontal` is
+        set and the coordinates are y-coordinates.
+      - `close`, called once all the seams have been removed, or once carving
+        has failed. This waits for any output to be written.
+    """
+
+    profiler = NULL_PROFILER
+
+    def start(self, pixels, profiler=NULL_PROFILER):
+        self.profiler = profiler
+
+    def add_seam(self, i, seam_xs, horizontal=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class BackgroundFrameSink(FrameSink):
+    """
+    A frame sink that renders every `every`-th seam on the image it was removed
+    from, on a background thread. Subclasses implement `write_frame`, which is
+    called on that thread with the iteration number and the rendered image,
+    and optionally `finish`, called on that thread once all seams are done.
+    Both return the number of bytes they wrote, if any, which is recorded in
+    the 'encode' stage.
+    """
+
+    def __init__(self, every=1):
+        self.every = every
+
+        self._seams = queue.Queue()
+        self._thread = None
+        self._error = None
+
+    def start(self, pixels, profiler=NULL_PROFILER):
+        super().start(pixels, profiler)
+
+        array = as_pixel_array(pixels)
+        if array is None:
+            array = colors_to_array(pixels)
+
+        # The buffer copies the pixels, so the caller can keep modifying its
+        # own copy while the thread is still catching up. Seams are never
+        # searched for on the thread, so it only needs the pixels.
+        buffer = PixelBuffer(array)
+
+        self._thread = threading.Thread(target=self._run, args=(buffer,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_seam(self, i, seam_xs, horizontal=False):
+        # Once the thread has failed, nothing reads the queue anymore, so the
+        # error is raised right away instead of at the end.
+        self._raise_error()
+        self._seams.put((i, np.array(seam_xs), horizontal))
+
+    def close(self):
+        if self._thread is None:
+            return
+
+        self._seams.put(None)
+        self._thread.join()
+        self._thread = None
+
+        self._raise_error()
+
+    def _raise_error(self):
+        # The error is only raised once, so that `close` doesn't raise it
+        # again after `add_seam` did.
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _run(self, buffer):
+        try:
+            while True:
+                item = self._seams.get()
+                if item is None:
+                    break
+
+                i, seam_xs, horizontal = item
+                if i % self.every == 0:
+                    with self.profiler.stage('visualize', i):
+                        pixels = buffer.view(horizontal)
+                        frame = visualize_seam_on_image(pixels, seam_xs)
+                        if horizontal:
+                            frame = frame.transpose(1, 0, 2)
+
+                    with self.profiler.stage('encode', i) as record:
+                        record['bytes_written'] = \
+                            self.write_frame(i, frame) or 0
+
+                buffer.remove_seam(seam_xs, horizontal)
+
+            with self.profiler.stage('encode') as record:
+                record['bytes_written'] = self.finish() or 0
+        except Exception as e:
+            self._error = e
+
+    def write_frame(self, i, frame):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class PngFrameSink(BackgroundFrameSink):
+    """
+    Saves every `every`-th intermediate image as a separate PNG file, named by
+    filling in the iteration number in `filename_pattern`.
+    """
+
+    def __init__(self, every=1, filename_pattern='intermediate-{i}.png'):
+        super().__init__(every)
+        self.filename_pattern = filename_pattern
+
+    def write_frame(self, i, frame):
+        filename = self.filename_pattern.format(i=i)
+        write_array_into_image(frame, filename)
+        return os.path.getsize(filename)
+
+
+class AnimatedFrameSink(BackgroundFrameSink):
+    """
+    Saves every `every`-th intermediate image as a frame of a single animated
+    image, such as a GIF. As the image gets narrower, frames are padded on the
+    right to the original width.
+
+    Frames are held in memory until the end, so `every` should be large enough
+    for them to fit.
+    """
+
+    def __init__(self, filename='carving.gif', every=1, frame_duration=100):
+        super().__init__(every)
+        self.filename = filename
+        self.frame_duration = frame_duration
+
+        self._frames = []
+        self._size = None
+
+    def start(self, pixels, profiler=NULL_PROFILER):
+        self._size = (len(pixels), len(pixels[0]))
+        super().start(pixels, profiler)
+
+    def write_frame(self, i, frame):
+        h, w = frame.shape[:2]
+        padded = np.zeros(self._size + (3,), dtype=np.uint8)
+        padded[:h, :w] = frame
+        self._frames.append(Image.fromarray(padded))
+
+    def finish(self):
+        if not self._frames:
+            return
+
+        first_frame, *other_frames = self._frames
+        first_frame.save(
+            self.filename,
+            save_all=True,
+            append_images=other_frames,
+            duration=self.frame_duration,
+            loop=0
+        )
+        self._frames = []
+
+        return os.path.getsize(self.filename)
+
+
+class SeamLogFrameSink(FrameSink):
+    """
+    Saves the coordinates of all the seams into a single .npz file. Together
+    with the original image, this is enough to reconstruct any intermediate
+    image later, at a tiny fraction of the size. The file contains:
+
+      - `coordinates`: the coordinates of all the seams, one after the other.
+      - `lengths`: the number of coordinates in each seam.
+      - `horizontal`: whether each seam is horizontal.
+    """
+
+    def __init__(self, filename='seams.npz'):
+        self.filename = filename
+        self._seams = []
+        self._horizontal = []
+
+    def add_seam(self, i, seam_xs, horizontal=False):
+        self._seams.append(np.array(seam_xs, dtype=np.int32))
+        self._horizontal.append(horizontal)
+
+    def close(self):
+        with self.profiler.stage('encode') as record:
+            np.savez(
+                self.filename,
+                coordinates=np.concatenate(
+                    self._seams or [np.empty(0, np.int32)]
+                ),
+                lengths=np.array([len(seam) for seam in self._seams], np.int32),
+                horizontal=np.array(self._horizontal, dtype=bool)
+            )
+            record['bytes_written'] = os.path.getsize(self.filename)
+
+        self._seams = []
+        self._horizontal = []
+
+
+def make_frame_sink(spec):
+    """
+    Create a frame sink from a short description, for use in command-line
+    arguments: 'none', 'png', 'gif' or 'seams', optionally followed by a colon
+    and how often to output a frame, as in 'png:10'. Frame sinks are passed
+    through unchanged, and `None` means 'none'.
+    """
+
+    if spec is None:
+        return FrameSink()
+    if isinstance(spec, FrameSink):
+        return spec
+
+    kind, _, every = spec.partition(':')
+    every = int(every) if every else 1
+
+    if kind == 'none':
+        return FrameSink()
+    if kind == 'png':
+        return PngFrameSink(every)
+    if kind == 'gif':
+        return AnimatedFrameSink(every=every)
+    if kind == 'seams':
+        return SeamLogFrameSink()
+
+    raise ValueError(f'Unknown frame sink: {spec}')
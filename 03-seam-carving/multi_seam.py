@@ -0,0 +1,290 @@
+"""
+An approximate, faster version of the seam carving process. Instead of
+computing the energy and the lowest-energy seam once for every seam that gets
+removed, up to `k` seams are taken from the same pass: the lowest-energy seams
+ending at different positions, as long as they don't touch or cross each other.
+
+Seams taken together are each optimal for the image as it was at the start of
+the pass, but not necessarily for the image after the other seams are removed,
+which is why the result can differ from the exact process. To keep the
+difference small, a pass only takes seams whose energy is close to that of its
+lowest-energy seam (see `MAX_ENERGY_RATIO`), falling back to a single seam when
+no other seam is close enough. The report returned along with the image says
+how far the result is from the exact process.
+
+    python3 multi_seam.py surfer.jpg 100 8 surfer-resized.png [1.5]
+"""
+
+import functools
+import sys
+
+import numpy as np
+
+from carve import remove_n_lowest_seams_from_image
+from energy import compute_energy, get_energy_kernel
+from seam_v2 import backtrack_seam, compute_seam_offsets
+from utils import read_image_into_array, write_array_into_image
+
+
+# By default, a pass only takes seams whose energy is at most this many times
+# that of the lowest-energy seam. Without that limit, later seams in a pass can
+# have far more energy than those the exact process would remove instead.
+MAX_ENERGY_RATIO = 1.5
+
+class BatchCarvingReport:
+    """
+    A summary of a run of `remove_n_lowest_seams_in_batches`:
+
+      - The number of energy/seam passes that were needed.
+      - The total energy of the removed seams, each measured in the image as it
+        was at the start of the pass it was removed in.
+      - The same total for the exact, one-seam-at-a-time process, if it was
+        computed for comparison.
+    """
+
+    def __init__(self, passes, removed_energy, exact_removed_energy=None):
+        self.passes = passes
+        self.removed_energy = removed_energy
+        self.exact_removed_energy = exact_removed_energy
+
+    @property
+    def energy_gap(self):
+        """
+        How much more energy was removed than by the exact process, as a
+        fraction of the exact total.
+        """
+
+        if not self.exact_removed_energy:
+            return None
+        return self.removed_energy / self.exact_removed_energy - 1
+
+    def __repr__(self):
+        return (
+            f'BatchCarvingReport(passes={self.passes}, '
+            f'removed_energy={self.removed_energy}, '
+            f'exact_removed_energy={self.exact_removed_energy})'
+        )
+
+
+def seams_collide(seam_xs, other_seams):
+    """
+    Whether the given seam touches or crosses any of the other seams, given as
+    a 2D array with one seam per row. Two seams don't collide if one of them is
+    strictly to the left of the other in every row.
+    """
+
+    if len(other_seams) == 0:
+        return False
+
+    differences = other_seams - seam_xs
+    apart = np.all(differences > 0, axis=1) | np.all(differences < 0, axis=1)
+    return not np.all(apart)
+
+
+def find_lowest_seams(
+    energy_data,
+    max_seams,
+    max_energy_ratio=MAX_ENERGY_RATIO,
+    transition_costs=None
+):
+    """
+    Find up to `max_seams` low-energy vertical seams that don't collide with
+    each other, using a single pass of the seam recurrence relation.
+
+    Following the back pointers from every position in the last row at once
+    shows where each of those seams starts. Seams that touch share everything
+    above the point where they meet, so they start at the same position, and
+    only the lowest-energy seam starting at each position is a candidate.
+
+    Candidates are tried from lowest to highest energy, skipping any that
+    cross a seam that was already taken. The search stops at the first
+    candidate whose energy is more than `max_energy_ratio` times that of the
+    lowest-energy seam, and that candidate and all those after it are left for
+    later passes. If no other seam qualifies, the pass falls back to a single
+    seam, which is always the exact lowest-energy one. Setting
+    `max_energy_ratio` to `None` takes every candidate that doesn't collide.
+
+    `transition_costs` is as in `compute_seam_offsets`.
+
+    Returns a tuple with two values:
+
+      1. A 2D array of seams, one per row, each a list of x-coordinates from
+         the top of the image.
+      2. The total energies of those seams.
+    """
+
+    offsets, last_row = compute_seam_offsets(
+        energy_data,
+        transition_costs=transition_costs
+    )
+    h, w = offsets.shape
+
+    start_xs = np.arange(w)
+    for y in range(h - 1, 0, -1):
+        start_xs += offsets[y, start_xs]
+
+    end_xs = np.argsort(last_row, kind='stable')
+    _, first_for_start = np.unique(start_xs[end_xs], return_index=True)
+    end_xs = end_xs[np.sort(first_for_start)]
+
+    lowest_energy = last_row[end_xs[0]]
+
+    seams = np.empty((0, h), dtype=np.intp)
+    seam_energies = []
+
+    for end_x in end_xs:
+        seam_energy = last_row[end_x]
+        if max_energy_ratio is not None and \
+                seam_energy > lowest_energy * max_energy_ratio:
+            break
+
+        seam_xs = backtrack_seam(offsets, end_x)
+        if seams_collide(seam_xs, seams):
+            continue
+
+        seams = np.vstack((seams, seam_xs))
+        seam_energies.append(seam_energy.item())
+
+        if seams.shape[0] == max_seams:
+            break
+
+    return (seams, seam_energies)
+
+
+def remove_seams_from_image(image, seams):
+    """
+    Remove several non-colliding seams from an H×W×3 array of pixels at once.
+    """
+
+    h, w = image.shape[:2]
+
+    keep = np.ones((h, w), dtype=bool)
+    keep[np.arange(h), seams] = False
+
+    return image[keep].reshape((h, w - seams.shape[0]) + image.shape[2:])
+
+
+def remove_n_lowest_seams_in_batches(
+    image,
+    num_seams_to_remove,
+    seams_per_pass=8,
+    max_energy_ratio=MAX_ENERGY_RATIO,
+    compare_exact=False,
+    energy='gradient',
+    verbose=True
+):
+    """
+    Remove `num_seams_to_remove` seams from an H×W×3 array of pixels, taking up
+    to `seams_per_pass` seams from each energy/seam pass (see
+    `find_lowest_seams`), as long as their energy is within
+    `max_energy_ratio` of the pass's lowest-energy seam.
+
+    If `compare_exact` is set, the exact process is also run, so that the
+    report can include how far the removed energy is from it.
+
+    The energy is measured by the kernel named by `energy` (see
+    `compute_energy` in the `energy` module). Progress is printed for every
+    pass, unless `verbose` is turned off.
+
+    Returns a tuple with two values:
+
+      1. The resized image.
+      2. A `BatchCarvingReport` for the run.
+    """
+
+    original_image = image
+    kernel = get_energy_kernel(energy)
+    log = print if verbose else _ignore
+
+    passes = 0
+    removed_energy = 0
+    num_seams_left = num_seams_to_remove
+
+    while num_seams_left > 0:
+        log(f'Pass {passes + 1}: {num_seams_left} seams left')
+
+        log('  Computing energy...')
+        energy_data = compute_energy(image, kernel)
+
+        if kernel.has_transition_costs:
+            transition_costs = \
+                functools.partial(kernel.transition_costs_row, image)
+        else:
+            transition_costs = None
+
+        log('  Finding the lowest-energy seams...')
+        seams, seam_energies = find_lowest_seams(
+            energy_data,
+            min(seams_per_pass, num_seams_left),
+            max_energy_ratio,
+            transition_costs
+        )
+
+        log(f'  Removing {seams.shape[0]} seams...')
+        image = remove_seams_from_image(image, seams)
+
+        passes += 1
+        removed_energy += sum(seam_energies)
+        num_seams_left -= seams.shape[0]
+
+    exact_removed_energy = None
+    if compare_exact:
+        exact_seam_energies = []
+        remove_n_lowest_seams_from_image(
+            original_image,
+            num_seams_to_remove,
+            incremental=True,
+            frame_sink='none',
+            on_seam_removed=lambda i, seam_xs, seam_energy:
+                exact_seam_energies.append(seam_energy),
+            energy=kernel,
+            verbose=verbose
+        )
+        exact_removed_energy = sum(exact_seam_energies)
+
+    report = BatchCarvingReport(passes, removed_energy, exact_removed_energy)
+    return (image, report)
+
+
+def _ignore(*args):
+    pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (5, 6):
+        print(
+            f'USAGE: {__file__} '
+            '<input> <num-seams-to-remove> <seams-per-pass> <output> '
+            '[<max-energy-ratio>]'
+        )
+        sys.exit(1)
+
+    input_filename = sys.argv[1]
+    num_seams_to_remove = int(sys.argv[2])
+    seams_per_pass = int(sys.argv[3])
+    output_filename = sys.argv[4]
+    max_energy_ratio = \
+        float(sys.argv[5]) if len(sys.argv) == 6 else MAX_ENERGY_RATIO
+
+    print(f'Reading {input_filename}...')
+    pixels = read_image_into_array(input_filename, as_array=True)
+
+    resized_pixels, report = remove_n_lowest_seams_in_batches(
+        pixels,
+        num_seams_to_remove,
+        seams_per_pass,
+        max_energy_ratio,
+        compare_exact=True
+    )
+
+    print(f'Saving {output_filename}')
+    write_array_into_image(resized_pixels, output_filename)
+
+    print()
+    print(f'Passes: {report.passes}')
+    print(f'Removed energy: {report.removed_energy}')
+    print(f'Removed energy (exact): {report.exact_removed_energy}')
+    if report.energy_gap is None:
+        print('Difference: n/a (the exact process removed no energy)')
+    else:
+        print(f'Difference: {report.energy_gap:+.2%}')
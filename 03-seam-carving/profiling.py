@@ -0,0 +1,299 @@
+"""
+Measuring where the time goes when carving seams. The carving process is split
+into stages, and a profiler records every time a stage runs:
+
+  - 'energy': computing the energy of the image, or updating it around a seam.
+  - 'dp': running the seam recurrence relation.
+  - 'backtrack': following the back pointers to reconstruct the seam.
+  - 'removal': removing the seam from the image.
+  - 'visualize': drawing a seam on an intermediate image, in a frame sink.
+  - 'encode': encoding and writing an intermediate image, in a frame sink.
+
+Each record has the wall time of the stage and, if memory tracing is turned on,
+the peak memory allocated during the stage. Stages that write files also record
+how many bytes were written. Records are handed to hooks as they're made, and
+can be saved as a JSON or CSV report.
+
+By default, nothing is recorded: the carving functions use `NULL_PROFILER`,
+whose stages do nothing. Running this module carves an image with profiling
+turned on, and prints a summary of each stage:
+
+    python3 profiling.py surfer.jpg 10 profile.json
+"""
+
+import contextlib
+import csv
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+
+STAGES = ('energy', 'dp', 'backtrack', 'removal', 'visualize', 'encode')
+
+RECORD_FIELDS = (
+    'stage',
+    'iteration',
+    'seconds',
+    'peak_memory',
+    'bytes_written',
+)
+
+
+class NullProfiler:
+    """
+    A profiler that records nothing. Its `stage` returns the same do-nothing
+    context manager every time, so instrumented code pays for one method call
+    per stage and nothing else.
+
+    The iteration set by the carving loop is ignored, since `NULL_PROFILER` is
+    shared by every caller, including those running on other threads.
+    """
+
+    enabled = False
+
+    @property
+    def iteration(self):
+        return None
+
+    @iteration.setter
+    def iteration(self, iteration):
+        pass
+
+    def __init__(self):
+        self._record = {}
+        self._stage = contextlib.nullcontext(self._record)
+
+    def stage(self, name, iteration=None):
+        return self._stage
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StageProfiler:
+    """
+    Records the wall time of each stage of the carving process, and optionally
+    its peak memory use.
+
+      - If `trace_memory` is set, memory allocations are traced with
+        `tracemalloc`, which slows everything down noticeably. Tracing starts
+        with the first stage, if it isn't already running, and stops when the
+        profiler is closed, or at the end of its `with` block. The
+        `peak_memory` of each record is then the highest number of bytes
+        allocated during the stage, above what was allocated when it started.
+        The peak can only be measured for the whole process, so when stages
+        overlap, such as those of frame sinks running on another thread, the
+        peak of each one also covers the stages running at the same time, and
+        those that started before it.
+      - Each of the `hooks` is called with every record, as a dictionary, as
+        soon as its stage is over. Hooks may be called from a background
+        thread.
+
+    A stage is measured by using `stage` as a context manager, which gives the
+    record being made. Code that writes files adds the number of bytes written
+    to its `bytes_written` entry. Stages are numbered by the seam being removed
+    when they ran, which the carving loop keeps up to date in `iteration`,
+    unless another number is given.
+    """
+
+    enabled = True
+
+    def __init__(self, trace_memory=False, hooks=()):
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks)
+        self.records = []
+        self.iteration = None
+
+        self._started_tracing = False
+
+        # The number of stages running at the moment, on any thread, which
+        # decides whether the peak can be reset.
+        self._lock = threading.Lock()
+        self._active_stages = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop tracing memory allocations, if the profiler started it.
+        """
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name, iteration=None):
+        record = {
+            'stage': name,
+            'iteration': self.iteration if iteration is None else iteration,
+            'seconds': None,
+            'peak_memory': None,
+            'bytes_written': 0,
+        }
+
+        tracing = self.trace_memory
+        if tracing:
+            with self._lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracing = True
+
+                start_memory, _ = tracemalloc.get_traced_memory()
+                # Resetting the peak while another stage is running would lose
+                # that stage's peak so far. Older versions of Python can't
+                # reset it at all, in which case it is the highest since
+                # tracing started.
+                if self._active_stages == 0 and \
+                        hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                self._active_stages += 1
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if tracing:
+                with self._lock:
+                    _, peak_memory = tracemalloc.get_traced_memory()
+                    self._active_stages -= 1
+                record['peak_memory'] = max(peak_memory - start_memory, 0)
+
+            self.records.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def summary(self):
+        """
+        Add up the records of each stage, returning one dictionary per stage
+        with the number of times it ran, its total and average wall time, its
+        highest peak memory and the total bytes it wrote.
+        """
+
+        stages = {}
+        for record in self.records:
+            name = record['stage']
+            if name not in stages:
+                stages[name] = {
+                    'stage': name,
+                    'count': 0,
+                    'total_seconds': 0,
+                    'mean_seconds': 0,
+                    'peak_memory': None,
+                    'bytes_written': 0,
+                }
+
+            stage = stages[name]
+            stage['count'] += 1
+            stage['total_seconds'] += record['seconds']
+            stage['bytes_written'] += record['bytes_written']
+            if record['peak_memory'] is not None:
+                stage['peak_memory'] = max(
+                    stage['peak_memory'] or 0,
+                    record['peak_memory']
+                )
+
+        for stage in stages.values():
+            stage['mean_seconds'] = stage['total_seconds'] / stage['count']
+
+        order = {name: i for i, name in enumerate(STAGES)}
+        return sorted(
+            stages.values(),
+            key=lambda stage: order.get(stage['stage'], len(order))
+        )
+
+    def write_json(self, filename):
+        """
+        Save the summary and every record as a JSON object.
+        """
+
+        with open(filename, 'w') as f:
+            json.dump(
+                {'summary': self.summary(), 'records': self.records},
+                f,
+                indent=2
+            )
+
+    def write_csv(self, filename):
+        """
+        Save every record as a row of a CSV file.
+        """
+
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def write_report(self, filename):
+        """
+        Save a CSV report if the filename ends in '.csv', and a JSON report
+        otherwise.
+        """
+
+        if filename.endswith('.csv'):
+            self.write_csv(filename)
+        else:
+            self.write_json(filename)
+
+
+def print_summary(summary):
+    print(f'{"Stage":<10} {"Count":>6} {"Total (s)":>10} {"Mean (ms)":>10} '
+          f'{"Peak (KiB)":>11} {"Written (KiB)":>14}')
+
+    for stage in summary:
+        peak_memory = stage['peak_memory']
+        peak_memory = '-' if peak_memory is None else f'{peak_memory / 1024:.1f}'
+        print(
+            f'{stage["stage"]:<10} '
+            f'{stage["count"]:>6} '
+            f'{stage["total_seconds"]:>10.3f} '
+            f'{stage["mean_seconds"] * 1000:>10.2f} '
+            f'{peak_memory:>11} '
+            f'{stage["bytes_written"] / 1024:>14.1f}'
+        )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (4, 5):
+        print(
+            f'USAGE: {__file__} '
+            '<input> <num-seams-to-remove> <report> [<frame-sink>]'
+        )
+        sys.exit(1)
+
+    # Imported here, since the carving modules import this one.
+    from carve import remove_n_lowest_seams_from_image
+    from utils import read_image_into_array
+
+    input_filename = sys.argv[1]
+    num_seams_to_remove = int(sys.argv[2])
+    report_filename = sys.argv[3]
+    frame_sink = sys.argv[4] if len(sys.argv) == 5 else 'png'
+
+    print(f'Reading {input_filename}...')
+    pixels = read_image_into_array(input_filename, as_array=True)
+
+    print(f'Removing {num_seams_to_remove} seams...')
+    with StageProfiler(trace_memory=True) as profiler:
+        remove_n_lowest_seams_from_image(
+            pixels,
+            num_seams_to_remove,
+            incremental=True,
+            frame_sink=frame_sink,
+            profiler=profiler,
+            verbose=False
+        )
+
+    print()
+    print_summary(profiler.summary())
+
+    print()
+    print(f'Saving {report_filename}')
+    profiler.write_report(report_filename)
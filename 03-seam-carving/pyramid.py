@@ -0,0 +1,129 @@
+"""
+A faster, approximate way of finding the lowest-energy vertical seam in a large
+image. The energy is repeatedly halved in size to form a pyramid. The seam is
+found exactly at the smallest level, then scaled up one level at a time, and at
+each level only a narrow band of columns around the scaled-up seam is searched.
+
+Running this module compares the search with the exact one on some images,
+reporting the time taken and how much more energy the seam found has:
+
+    python3 pyramid.py surfer.jpg arch.jpg
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from energy import compute_energy
+from seam_v2 import compute_vertical_seam_array, compute_vertical_seam_in_band
+from utils import read_image_into_array
+
+
+def downsample_energy(energy_data):
+    """
+    Halve the size of an energy array in both directions, adding up each 2×2
+    block of energies. An odd row or column at the edge is repeated to fill its
+    block.
+    """
+
+    h, w = energy_data.shape
+    padded = np.pad(
+        energy_data.astype(np.int64, copy=False),
+        ((0, h % 2), (0, w % 2)),
+        mode='edge'
+    )
+
+    return padded[0::2, 0::2] + padded[0::2, 1::2] + \
+        padded[1::2, 0::2] + padded[1::2, 1::2]
+
+
+def build_energy_pyramid(energy_data, levels, min_size=16):
+    """
+    Build a list of energy arrays, starting with the given one and halving in
+    size each time, with at most `levels` entries. Halving stops early once a
+    level would have fewer than `min_size` rows or columns.
+    """
+
+    pyramid = [energy_data]
+    while len(pyramid) < levels and min(pyramid[-1].shape) >= 2 * min_size:
+        pyramid.append(downsample_energy(pyramid[-1]))
+
+    return pyramid
+
+
+def compute_vertical_seam_pyramid(energy_data, levels=3, band_radius=4):
+    """
+    Find a low-energy vertical seam given an H×W array of energies, using a
+    pyramid with up to `levels` levels (one level being the exact search).
+
+    When scaling a seam up to the next level, each pixel of the seam covers
+    two columns, and `band_radius` more columns are searched on either side.
+    It can be a single number, or a list with one number per level, starting
+    with the full-size level.
+
+    Returns the same tuple as `compute_vertical_seam_array`, with the energy of
+    the seam measured in the full-size energy.
+    """
+
+    pyramid = build_energy_pyramid(energy_data, levels)
+
+    if np.ndim(band_radius) == 0:
+        band_radius = [band_radius] * len(pyramid)
+
+    seam_xs, seam_energy = compute_vertical_seam_array(pyramid[-1])
+
+    for level in range(len(pyramid) - 2, -1, -1):
+        level_energy = pyramid[level]
+        h = level_energy.shape[0]
+        radius = band_radius[level]
+
+        scaled_xs = 2 * np.repeat(seam_xs, 2)[:h]
+        seam_xs, seam_energy = compute_vertical_seam_in_band(
+            level_energy,
+            scaled_xs - radius,
+            2 * radius + 2
+        )
+
+    return (seam_xs, seam_energy)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'USAGE: {__file__} <input> [<input> ...]')
+        sys.exit(1)
+
+    settings = [(2, 4), (3, 4), (4, 4), (4, 8)]
+
+    for input_filename in sys.argv[1:]:
+        print(f'Reading {input_filename}...')
+        energy_data = compute_energy(
+            read_image_into_array(input_filename, as_array=True)
+        )
+
+        duration = timeit.timeit(
+            lambda: compute_vertical_seam_array(energy_data),
+            number=3
+        ) / 3
+        _, exact_energy = compute_vertical_seam_array(energy_data)
+        print(f'  exact             : {duration:8.5f}s  energy {exact_energy}')
+
+        for levels, band_radius in settings:
+            duration = timeit.timeit(
+                lambda: compute_vertical_seam_pyramid(
+                    energy_data,
+                    levels,
+                    band_radius
+                ),
+                number=3
+            ) / 3
+            _, seam_energy = compute_vertical_seam_pyramid(
+                energy_data,
+                levels,
+                band_radius
+            )
+            gap = seam_energy / exact_energy - 1
+            print(
+                f'  levels={levels} band={band_radius}: {duration:8.5f}s  '
+                f'energy {seam_energy} ({gap:+.2%})'
+            )
@@ -0,0 +1,93 @@
+"""
+Resizing an image in both directions, by removing both vertical and
+horizontal seams. Horizontal seams are handled by the same workspace as
+vertical ones, working on a transposed view of the image (see `workspace`).
+
+The order in which seams are removed matters. By default, at each step, the
+lowest-energy seam in each direction is found, and whichever has the lower
+energy per pixel is removed. This is a greedy approximation of the optimal
+order, which would require keeping an intermediate image for every
+combination of widths and heights.
+
+    python3 resize.py surfer.jpg 1600 900 surfer-resized.png
+"""
+
+import sys
+
+from utils import read_image_into_array, write_array_into_image
+from workspace import CarvingWorkspace
+
+
+def retarget_image(pixels, width, height, order='greedy'):
+    """
+    Resize the given H×W×3 array of pixels down to the given width and height
+    by removing seams.
+
+    The `order` in which seams are removed can be:
+
+      - 'greedy': at each step, remove whichever of the lowest-energy vertical
+        and horizontal seams has the lower average energy per pixel.
+      - 'vertical-first': remove all the vertical seams, then all the
+        horizontal ones.
+      - 'horizontal-first': the other way around.
+
+    Returns the resized image, as a view into the workspace used.
+    """
+
+    h, w = pixels.shape[:2]
+    if width > w or height > h:
+        raise ValueError('Images can only be made smaller')
+    if order not in ('greedy', 'vertical-first', 'horizontal-first'):
+        raise ValueError(f'Unknown seam order: {order}')
+
+    workspace = CarvingWorkspace(pixels)
+    workspace.compute_energy()
+
+    while workspace.width > width or workspace.height > height:
+        remove_vertical = workspace.width > width
+        remove_horizontal = workspace.height > height
+
+        if remove_vertical and remove_horizontal:
+            if order == 'vertical-first':
+                remove_horizontal = False
+            elif order == 'horizontal-first':
+                remove_vertical = False
+
+        if remove_vertical:
+            seam_xs, vertical_energy = workspace.find_seam()
+        if remove_horizontal:
+            seam_ys, horizontal_energy = workspace.find_seam(transposed=True)
+
+        if remove_vertical and remove_horizontal:
+            # Seams in different directions have different lengths, so they're
+            # compared by their average energy instead of their total.
+            remove_vertical = vertical_energy / workspace.height <= \
+                horizontal_energy / workspace.width
+
+        if remove_vertical:
+            workspace.remove_seam(seam_xs)
+        else:
+            workspace.remove_seam(seam_ys, transposed=True)
+
+    return workspace.pixels
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (5, 6):
+        print(f'USAGE: {__file__} <input> <width> <height> <output> [<order>]')
+        sys.exit(1)
+
+    input_filename = sys.argv[1]
+    width = int(sys.argv[2])
+    height = int(sys.argv[3])
+    output_filename = sys.argv[4]
+    order = sys.argv[5] if len(sys.argv) == 6 else 'greedy'
+
+    print(f'Reading {input_filename}...')
+    pixels = read_image_into_array(input_filename, as_array=True)
+
+    print(f'Resizing to {width}x{height}...')
+    resized_pixels = retarget_image(pixels, width, height, order)
+
+    print(f'Saving {output_filename}')
+    write_array_into_image(resized_pixels, output_filename)
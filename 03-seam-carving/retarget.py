@@ -0,0 +1,192 @@
+"""
+Resizing the same image to many widths. Instead of running the seam carving
+process once per width, the process is run once, removing as many seams as the
+narrowest width needs, and the iteration in which each pixel was removed is
+recorded in a "retargeting index". Any width in between is then a matter of
+dropping the pixels removed before that width was reached.
+
+The index is saved next to the image, along with a hash of the pixels it was
+built from and the name of the energy kernel used, so that running this module
+again for other widths skips the seam carving entirely, as long as the image
+hasn't changed since:
+
+    python3 retarget.py surfer.jpg 1820 1870 1900
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+from carve import remove_n_lowest_seams_from_image, remove_seam_from_image
+from energy import get_energy_kernel
+from utils import read_image_into_array, write_array_into_image
+
+
+def build_retargeting_index(
+    pixels,
+    num_seams_to_remove,
+    verbose=True,
+    energy='gradient'
+):
+    """
+    Remove `num_seams_to_remove` seams from the given H×W×3 array of pixels,
+    recording the iteration in which each pixel was removed.
+
+    The result is an H×W array with the same shape as the original image.
+    Pixels that are never removed are marked with the largest value of the
+    array's type. The type is 16-bit if possible, and 32-bit otherwise.
+
+    Progress is printed for every seam, unless `verbose` is turned off. The
+    energy is measured by the kernel named by `energy`.
+    """
+
+    h, w = pixels.shape[:2]
+
+    if num_seams_to_remove < np.iinfo(np.uint16).max:
+        dtype = np.uint16
+    else:
+        dtype = np.uint32
+
+    index = np.full((h, w), np.iinfo(dtype).max, dtype=dtype)
+
+    # Where each pixel of the shrinking image was in the original image.
+    original_xs = np.tile(np.arange(w, dtype=np.int32), (h, 1))
+    ys = np.arange(h)
+
+    def record_seam(i, seam_xs, seam_energy):
+        nonlocal original_xs
+        index[ys, original_xs[ys, seam_xs]] = i
+        original_xs = remove_seam_from_image(original_xs, seam_xs)
+
+    remove_n_lowest_seams_from_image(
+        pixels,
+        num_seams_to_remove,
+        incremental=True,
+        frame_sink='none',
+        on_seam_removed=record_seam,
+        energy=energy,
+        verbose=verbose
+    )
+
+    return index
+
+
+def num_seams_in_index(index):
+    """
+    The number of seams recorded in a retargeting index, which is the most
+    that can be removed using it.
+    """
+
+    never_removed = np.iinfo(index.dtype).max
+    return int(np.count_nonzero(index[0] != never_removed))
+
+
+def retarget_to_width(pixels, index, width):
+    """
+    Resize the given H×W×3 array of pixels to the given width, using a
+    retargeting index built for the same image. The result is the same as
+    removing that many seams with `remove_n_lowest_seams_from_image`.
+    """
+
+    h, w = pixels.shape[:2]
+    num_seams_to_remove = w - width
+
+    if not 0 <= num_seams_to_remove <= num_seams_in_index(index):
+        raise ValueError(
+            f'Width {width} is outside of the range covered by the index: '
+            f'{w - num_seams_in_index(index)} to {w}'
+        )
+
+    keep = index >= num_seams_to_remove
+    return pixels[keep].reshape((h, width) + pixels.shape[2:])
+
+
+def index_filename_for(image_filename):
+    """
+    The filename under which the retargeting index for the given image is
+    saved, next to the image itself.
+    """
+
+    root, _ = os.path.splitext(image_filename)
+    return f'{root}.seams.npz'
+
+
+def hash_pixels(pixels):
+    """
+    A hash of an array of pixels, including its shape and type, to tell
+    whether an index was built from the same image.
+    """
+
+    pixels = np.ascontiguousarray(pixels)
+
+    digest = hashlib.sha1()
+    digest.update(f'{pixels.shape} {pixels.dtype.str}'.encode())
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+
+def save_retargeting_index(index, filename, pixels, energy='gradient'):
+    """
+    Save a retargeting index built from the given pixels with the given energy
+    kernel, along with a hash of the pixels and the name of the kernel.
+    """
+
+    np.savez(
+        filename,
+        index=index,
+        pixels_hash=hash_pixels(pixels),
+        energy=get_energy_kernel(energy).name
+    )
+
+
+def load_retargeting_index(filename, pixels, energy='gradient'):
+    """
+    Load the retargeting index saved by `save_retargeting_index`, returning
+    `None` if there is none, or if it was built from other pixels or with
+    another energy kernel.
+    """
+
+    if not os.path.exists(filename):
+        return None
+
+    with np.load(filename) as saved:
+        if str(saved['pixels_hash']) != hash_pixels(pixels) or \
+                str(saved['energy']) != get_energy_kernel(energy).name:
+            return None
+        return saved['index']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'USAGE: {__file__} <input> <width> [<width> ...]')
+        sys.exit(1)
+
+    input_filename = sys.argv[1]
+    widths = [int(width) for width in sys.argv[2:]]
+
+    print(f'Reading {input_filename}...')
+    pixels = read_image_into_array(input_filename, as_array=True)
+    w = pixels.shape[1]
+
+    index_filename = index_filename_for(input_filename)
+    index = load_retargeting_index(index_filename, pixels)
+    if index is not None:
+        print(f'Loaded {index_filename}')
+        if w - num_seams_in_index(index) > min(widths):
+            index = None
+
+    if index is None:
+        print(f'Building {index_filename}...')
+        index = build_retargeting_index(pixels, w - min(widths))
+        save_retargeting_index(index, index_filename, pixels)
+
+    root, _ = os.path.splitext(input_filename)
+    for width in widths:
+        output_filename = f'{root}-{width}.png'
+        print(f'Saving {output_filename}')
+        write_array_into_image(
+            retarget_to_width(pixels, index, width),
+            output_filename
+        )
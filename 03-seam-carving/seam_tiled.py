@@ -0,0 +1,237 @@
+"""
+Finding the lowest-energy vertical seam of very wide images, such as
+panoramas, on several cores at once.
+
+The rows are processed in blocks of a few rows. Within a block, the image is
+split into tiles of columns, and each tile runs the usual row recurrence (see
+`compute_seam_dp_row` in `seam_v2`) on its own thread. A seam moves by at most
+one column per row, so after k rows, the total seam energies at a position only
+depend on the previous block's results up to k columns away. Each tile therefore
+also processes a halo of as many columns as there are rows in the block on
+either side, whose results are thrown away, and the results for the tile itself
+are exactly those of the serial version. The back pointers are written straight
+into a shared array, since tiles never overlap.
+
+The array operations release the interpreter lock while they run, so threads
+share the work without copying the energy array to other processes. Running
+this module compares the serial and tiled versions on a wide generated image,
+or on the given image:
+
+    python3 seam_tiled.py [<input>]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from energy import compute_energy
+from seam_v2 import (
+    backtrack_seam,
+    compute_seam_dp_row,
+    compute_seam_offsets,
+    cumulative_dtype,
+)
+from utils import read_image_into_array
+
+
+def compute_seam_offsets_tiled(
+    energy_data,
+    tile_width=4096,
+    rows_per_block=64,
+    workers=None,
+    executor=None,
+    transition_costs=None,
+    offsets=None,
+    rows=None
+):
+    """
+    Compute the same back pointer offsets and last row of total seam energies
+    as `compute_seam_offsets`, splitting each block of `rows_per_block` rows
+    into tiles of `tile_width` columns that are processed in parallel.
+
+    The tiles are run on `executor` if given, and otherwise on a thread pool of
+    `workers` threads (by default, one per core) created for the call. Larger
+    blocks mean fewer round trips to the threads, but wider halos to compute.
+
+    `transition_costs` is as in `compute_seam_offsets`. The costs of each
+    block are computed once, before its tiles are handed out. So are the
+    buffers for the offsets and the two rows of total seam energies, which
+    can be passed in to avoid allocating them.
+    """
+
+    h, w = energy_data.shape
+
+    if executor is None:
+        with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+            return compute_seam_offsets_tiled(
+                energy_data,
+                tile_width,
+                rows_per_block,
+                executor=executor,
+                transition_costs=transition_costs,
+                offsets=offsets,
+                rows=rows
+            )
+
+    if offsets is None:
+        offsets = np.empty((h, w), dtype=np.int8)
+    if rows is None:
+        rows = np.empty((2, w), dtype=cumulative_dtype(energy_data))
+
+    offsets[0] = 0
+
+    previous, current = rows
+    previous[:] = energy_data[0]
+
+    tiles = [
+        (x_start, min(x_start + tile_width, w))
+        for x_start in range(0, w, tile_width)
+    ]
+
+    for y_start in range(1, h, rows_per_block):
+        y_end = min(y_start + rows_per_block, h)
+
+        costs = None
+        if transition_costs is not None:
+            costs = [transition_costs(y) for y in range(y_start, y_end)]
+
+        futures = [
+            executor.submit(
+                _compute_tile,
+                energy_data,
+                previous,
+                current,
+                offsets,
+                y_start,
+                y_end,
+                x_start,
+                x_end,
+                costs
+            )
+            for x_start, x_end in tiles
+        ]
+        for future in futures:
+            future.result()
+
+        previous, current = current, previous
+
+    return offsets, previous
+
+
+def _compute_tile(
+    energy_data,
+    previous,
+    result,
+    offsets,
+    y_start,
+    y_end,
+    x_start,
+    x_end,
+    costs
+):
+    # Runs the recurrence over rows [y_start, y_end) for the columns of the
+    # tile plus the halo, starting from the full `previous` row, and writes the
+    # part belonging to the tile into `offsets` and `result`.
+    w = energy_data.shape[1]
+    halo = y_end - y_start
+    halo_start = max(x_start - halo, 0)
+    halo_end = min(x_end + halo, w)
+    tile = slice(x_start - halo_start, x_end - halo_start)
+
+    n = halo_end - halo_start
+    rows = np.empty((2, n), dtype=previous.dtype)
+    rows[1] = previous[halo_start:halo_end]
+    offsets_row = np.empty(n, dtype=np.int8)
+    mask = np.empty(n, dtype=bool)
+    scratch = np.empty(n, dtype=previous.dtype)
+
+    left_costs = None
+    right_costs = None
+
+    for i, y in enumerate(range(y_start, y_end)):
+        if costs is not None:
+            left_costs = costs[i][0][halo_start:halo_end]
+            right_costs = costs[i][1][halo_start:halo_end]
+
+        compute_seam_dp_row(
+            rows[(i + 1) % 2],
+            energy_data[y, halo_start:halo_end],
+            rows[i % 2],
+            offsets_row,
+            mask,
+            left_costs,
+            right_costs,
+            scratch
+        )
+        offsets[y, x_start:x_end] = offsets_row[tile]
+
+    result[x_start:x_end] = rows[(halo - 1) % 2][tile]
+
+
+def compute_vertical_seam_tiled(
+    energy_data,
+    tile_width=4096,
+    rows_per_block=64,
+    workers=None,
+    executor=None,
+    transition_costs=None
+):
+    """
+    Find the lowest-energy vertical seam given an H×W array of energies, using
+    `compute_seam_offsets_tiled`. Returns the same tuple as
+    `compute_vertical_seam_array` in `seam_v2`.
+    """
+
+    offsets, last_row = compute_seam_offsets_tiled(
+        energy_data,
+        tile_width,
+        rows_per_block,
+        workers,
+        executor,
+        transition_costs
+    )
+
+    min_end_x = int(np.argmin(last_row))
+    seam_xs = backtrack_seam(offsets, min_end_x)
+
+    return (seam_xs, last_row[min_end_x].item())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (1, 2):
+        print(f'USAGE: {__file__} [<input>]')
+        sys.exit(1)
+
+    if len(sys.argv) == 2:
+        print(f'Reading {sys.argv[1]}...')
+        energy_data = compute_energy(
+            read_image_into_array(sys.argv[1], as_array=True)
+        )
+    else:
+        print('Generating a 24000x2000 energy array...')
+        rng = np.random.default_rng(0)
+        energy_data = rng.integers(0, 1 << 16, (2000, 24000), dtype=np.int32)
+
+    start = time.perf_counter()
+    expected_offsets, expected_last_row = compute_seam_offsets(energy_data)
+    serial_seconds = time.perf_counter() - start
+    print(f'Serial: {serial_seconds:.3f}s')
+
+    for workers in (1, 2, 4, 8, 16, 32):
+        if workers > os.cpu_count():
+            break
+
+        start = time.perf_counter()
+        offsets, last_row = \
+            compute_seam_offsets_tiled(energy_data, workers=workers)
+        seconds = time.perf_counter() - start
+
+        assert np.array_equal(offsets, expected_offsets)
+        assert np.array_equal(last_row, expected_last_row)
+        print(
+            f'Tiled, {workers:>2} workers: {seconds:.3f}s '
+            f'({serial_seconds / seconds:.2f}x)'
+        )
@@ -12,7 +12,10 @@ be visualized:
 
 import sys
 
+import numpy as np
+
 from energy import compute_energy
+from seam_v2 import compute_seam_dp_row, cumulative_dtype
 from utils import Color, read_image_into_array, write_array_into_image
 
 
@@ -52,6 +55,38 @@ def compute_vertical_seam_v1(energy_data):
     return m
 
 
+def compute_vertical_seam_v1_streaming(energy_rows):
+    """
+    Find the end x-coordinate and the total energy of the lowest-energy
+    vertical seam, like `compute_vertical_seam_v1`, but reading the energy one
+    row at a time from an iterable.
+
+    Only the total seam energies of the previous row are kept, so the memory
+    used is proportional to the width of the image, no matter how tall it is.
+    The rows can come from a generator such as `energy.iter_energy_rows` or
+    `energy.read_energy_rows`.
+
+    Returns the same tuple as `compute_vertical_seam_v1`.
+    """
+
+    energy_rows = iter(energy_rows)
+
+    first_row = np.asarray(next(energy_rows))
+    w = first_row.shape[0]
+
+    previous = first_row.astype(cumulative_dtype(first_row))
+    current = np.empty_like(previous)
+    offsets_row = np.empty(w, dtype=np.int8)
+    mask = np.empty(w, dtype=bool)
+
+    for energy_row in energy_rows:
+        compute_seam_dp_row(previous, energy_row, current, offsets_row, mask)
+        previous, current = current, previous
+
+    min_end_x = int(np.argmin(previous))
+    return (min_end_x, previous[min_end_x].item())
+
+
 def visualize_seam_end_on_image(pixels, end_x):
     """
     Draws a red box at the bottom of the image at the specified x-coordinate.
@@ -13,8 +13,16 @@ seam will be visualized:
 
 import sys
 
+import numpy as np
+
 from energy import compute_energy
-from utils import Color, read_image_into_array, write_array_into_image
+from utils import (
+    Color,
+    ColorGrid,
+    as_pixel_array,
+    read_image_into_array,
+    write_array_into_image,
+)
 
 
 class SeamEnergyWithBackPointer:
@@ -66,8 +74,15 @@ def compute_vertical_seam_v2(energy_data):
       1. The list of x-coordinates forming the lowest-energy seam, starting at
          the top of the image.
       2. The total energy of that seam.
+
+    If the energy is given as an H×W array, the seam is found by
+    `compute_vertical_seam_array` instead, which returns the same seam without
+    creating one object per pixel.
     """
 
+    if isinstance(energy_data, np.ndarray):
+        return compute_vertical_seam_array(energy_data)
+
     m_grid = [[None for _ in row] for row in energy_data]
 
     h = len(energy_data)
@@ -81,7 +96,7 @@ def compute_vertical_seam_v2(energy_data):
             x_min = x - 1 if x > 0 else 0
             x_max = x + 1 if x < w - 1 else w - 1
 
-            min_parent_x_index = min(range(x_min, x_max)
+            min_parent_x_index = min(range(x_min, x_max + 1)
                                      , key=lambda e: m_grid[y - 1][e].energy)
 
             m_grid[y][x] = SeamEnergyWithBackPointer(energy=m_grid[y - 1][min_parent_x_index].energy  # + his own
@@ -105,6 +120,268 @@ def compute_vertical_seam_v2(energy_data):
     return (seam_xs, seam_energy)
 
 
+def cumulative_dtype(energy_data):
+    """
+    The type used to add up seam energies: 64-bit integers for integer
+    energies, so that tall images can't overflow, and 64-bit floats otherwise.
+    """
+
+    if np.issubdtype(energy_data.dtype, np.integer):
+        return np.dtype(np.int64)
+    return np.dtype(np.float64)
+
+
+def compute_seam_dp_row(
+    previous,
+    energy_row,
+    current,
+    offsets_row,
+    mask,
+    left_costs=None,
+    right_costs=None,
+    scratch=None
+):
+    """
+    Compute one row of the seam recurrence relation, given the total seam
+    energies of the previous row:
+
+      current[x] = energy_row[x] + min(previous[x - 1: x + 2])
+
+    The chosen parent is written into `offsets_row` as an offset of -1, 0 or 1
+    from x. Ties go to the leftmost parent, like `min` does on a list.
+
+    If `left_costs` and `right_costs` are given, reaching x from the parent
+    above and to the left costs `left_costs[x]` more, and from the parent
+    above and to the right `right_costs[x]` more, as in forward energy (see
+    `EnergyKernel` in the `energy` module). `scratch` is then a row of the same
+    type as `previous`, used to hold the cost of each parent.
+
+    All the arguments are arrays of the same width, and `mask` is a boolean
+    scratch row. Nothing is allocated, so this can be called once per row
+    without creating any garbage.
+    """
+
+    current[:] = previous
+    offsets_row[:] = 0
+
+    right = previous[1:]
+    if right_costs is not None:
+        right = np.add(right, right_costs[:-1], out=scratch[:-1])
+
+    # The right parent only wins if it's strictly lower than the middle one...
+    np.less(right, current[:-1], out=mask[:-1])
+    np.copyto(current[:-1], right, where=mask[:-1])
+    np.copyto(offsets_row[:-1], 1, where=mask[:-1])
+
+    left = previous[:-1]
+    if left_costs is not None:
+        left = np.add(left, left_costs[1:], out=scratch[1:])
+
+    # ...while the left parent wins if it's no higher than the other two.
+    np.less_equal(left, current[1:], out=mask[1:])
+    np.copyto(current[1:], left, where=mask[1:])
+    np.copyto(offsets_row[1:], -1, where=mask[1:])
+
+    np.add(current, energy_row, out=current)
+
+
+def compute_seam_offsets(
+    energy_data,
+    offsets=None,
+    rows=None,
+    mask=None,
+    transition_costs=None
+):
+    """
+    Run the seam recurrence relation over an H×W energy array, one row at a
+    time. Only two rows of total seam energies are kept, while the back
+    pointers are stored as an H×W array of 8-bit offsets (-1, 0 or 1) from
+    each position to its parent in the previous row.
+
+    Buffers for the offsets, the two rows and a boolean scratch row can be
+    passed in to avoid allocating them.
+
+    If given, `transition_costs(y)` returns the extra costs of stepping into
+    row y from the left and from the right (see `compute_seam_dp_row`). They
+    are computed one row at a time, while the recurrence runs, instead of in
+    a separate pass over the whole image.
+
+    Returns a tuple with two values:
+
+      1. The H×W array of back pointer offsets.
+      2. The total energies of the lowest-energy seams ending at each position
+         in the last row.
+    """
+
+    h, w = energy_data.shape
+
+    if offsets is None:
+        offsets = np.empty((h, w), dtype=np.int8)
+    if rows is None:
+        rows = np.empty((2, w), dtype=cumulative_dtype(energy_data))
+    if mask is None:
+        mask = np.empty(w, dtype=bool)
+
+    left_costs = None
+    right_costs = None
+    scratch = None
+    if transition_costs is not None:
+        scratch = np.empty(w, dtype=rows.dtype)
+
+    rows[0] = energy_data[0]
+    offsets[0] = 0
+
+    for y in range(1, h):
+        if transition_costs is not None:
+            left_costs, right_costs = transition_costs(y)
+
+        compute_seam_dp_row(
+            rows[(y - 1) % 2],
+            energy_data[y],
+            rows[y % 2],
+            offsets[y],
+            mask,
+            left_costs,
+            right_costs,
+            scratch
+        )
+
+    return offsets, rows[(h - 1) % 2]
+
+
+def backtrack_seam(offsets, end_x, seam_xs=None):
+    """
+    Follow the back pointer offsets computed by `compute_seam_offsets` from the
+    given x-coordinate in the last row up to the top of the image. Returns the
+    x-coordinates of the seam, starting at the top of the image.
+    """
+
+    h = offsets.shape[0]
+
+    if seam_xs is None:
+        seam_xs = np.empty(h, dtype=np.intp)
+
+    x = int(end_x)
+    seam_xs[h - 1] = x
+    for y in range(h - 1, 0, -1):
+        x += int(offsets[y, x])
+        seam_xs[y - 1] = x
+
+    return seam_xs
+
+
+def compute_vertical_seam_array(energy_data, transition_costs=None):
+    """
+    Find the lowest-energy vertical seam given an H×W array of energies.
+
+    This returns the same seam as `compute_vertical_seam_v2`, but each row is
+    computed with a few whole-row array operations, and the back pointers take
+    a single byte per pixel instead of one `SeamEnergyWithBackPointer` each.
+    Extra `transition_costs` can be given as in `compute_seam_offsets`.
+
+    Returns a tuple with two values:
+
+      1. The array of x-coordinates forming the lowest-energy seam, starting at
+         the top of the image.
+      2. The total energy of that seam.
+    """
+
+    offsets, last_row = compute_seam_offsets(
+        energy_data,
+        transition_costs=transition_costs
+    )
+
+    min_end_x = int(np.argmin(last_row))
+    seam_xs = backtrack_seam(offsets, min_end_x)
+
+    return (seam_xs, last_row[min_end_x].item())
+
+
+def compute_vertical_seam_in_band(energy_data, band_starts, band_width):
+    """
+    Find the lowest-energy vertical seam given an H×W array of energies, only
+    considering seams that stay within a band of columns in every row. In row
+    y, the band covers the `band_width` columns starting at `band_starts[y]`.
+    Bands that would stick out of the image are moved back inside.
+
+    The work done is proportional to the area of the band, not of the image,
+    which is useful when the seam is roughly known in advance. When the band
+    covers the whole image, the result is the same as
+    `compute_vertical_seam_array`.
+
+    Returns the same tuple as `compute_vertical_seam_array`.
+    """
+
+    h, w = energy_data.shape
+    band_width = min(band_width, w)
+    band_starts = np.clip(band_starts, 0, w - band_width).astype(np.intp)
+
+    ys = np.arange(h)[:, np.newaxis]
+    band_xs = band_starts[:, np.newaxis] + np.arange(band_width)
+    band_energy = energy_data[ys, band_xs]
+
+    dtype = cumulative_dtype(energy_data)
+    if dtype.kind == 'f':
+        unreachable = np.inf
+    else:
+        # Leaves room to add energies to it without overflowing.
+        unreachable = np.iinfo(dtype).max // 2
+
+    # For each position in the band, the position of its parent in the band
+    # of the previous row.
+    parents = np.empty((h, band_width), dtype=np.int32)
+    parents[0] = 0
+
+    band_positions = np.arange(band_width, dtype=np.int32)
+
+    # The previous row, aligned with the current band and with one extra
+    # position on either side.
+    aligned = np.empty(band_width + 2, dtype=dtype)
+    previous = np.empty(band_width, dtype=dtype)
+    current = band_energy[0].astype(dtype)
+    offsets = np.empty(band_width, dtype=np.int32)
+    mask = np.empty(band_width, dtype=bool)
+
+    for y in range(1, h):
+        previous, current = current, previous
+        shift = band_starts[y] - band_starts[y - 1]
+
+        # aligned[i] holds previous[i - 1 + shift], where that's in the band.
+        lo = max(0, 1 - shift)
+        hi = min(band_width + 2, band_width + 1 - shift)
+        aligned[:max(lo, 0)] = unreachable
+        aligned[max(hi, lo):] = unreachable
+        if lo < hi:
+            aligned[lo:hi] = previous[lo - 1 + shift:hi - 1 + shift]
+
+        # The same choice of parent as `compute_seam_dp_row`.
+        current[:] = aligned[1:-1]
+        offsets.fill(shift)
+
+        np.less(aligned[2:], current, out=mask)
+        np.copyto(current, aligned[2:], where=mask)
+        np.copyto(offsets, shift + 1, where=mask)
+
+        np.less_equal(aligned[:-2], current, out=mask)
+        np.copyto(current, aligned[:-2], where=mask)
+        np.copyto(offsets, shift - 1, where=mask)
+
+        np.add(band_positions, offsets, out=parents[y])
+        np.add(current, band_energy[y], out=current)
+
+    min_end = int(np.argmin(current))
+    if current[min_end] >= unreachable:
+        raise ValueError('No vertical seam fits within the band')
+
+    seam_xs = np.empty(h, dtype=np.intp)
+    position = min_end
+    for y in range(h - 1, -1, -1):
+        seam_xs[y] = band_starts[y] + position
+        position = parents[y, position]
+
+    return (seam_xs, current[min_end].item())
+
+
 def visualize_seam_on_image(pixels, seam_xs):
     """
     Draws a red line on the image along the given seam. This is done to
@@ -113,6 +390,15 @@ def visualize_seam_on_image(pixels, seam_xs):
     This is NOT one of the functions you have to implement.
     """
 
+    array = as_pixel_array(pixels)
+    if array is not None:
+        h, w = array.shape[:2]
+        xs = np.arange(w)
+        seam = np.asarray(seam_xs)[:, np.newaxis]
+        new_array = array.copy()
+        new_array[np.abs(xs - seam) <= 2] = (255, 0, 0)
+        return ColorGrid(new_array) if array is not pixels else new_array
+
     h = len(pixels)
     w = len(pixels[0])
 
@@ -137,7 +423,7 @@ if __name__ == '__main__':
     output_filename = "surfer-seam.jpg"
 
     print(f'Reading {input_filename}...')
-    pixels = read_image_into_array(input_filename)
+    pixels = read_image_into_array(input_filename, as_array=True)
 
     print('Computing the energy...')
     energy_data = compute_energy(pixels)
@@ -3,10 +3,16 @@ A set of utilities that are helpful for working with images. These are utilities
 needed to actually apply the seam carving algorithm to images, but because they
 aren't core the algorithm, they are implemented for you.
 
+Images can be read either as a 2D array of `Color` objects (the default), or as
+a contiguous H×W×3 array of 8-bit RGB values, which is much faster and smaller
+for large photos. `ColorGrid` wraps such an array so that code written against
+`Color` objects keeps working.
+
 There is no need to change any code in this module.
 """
 
 
+import numpy as np
 from PIL import Image
 
 
@@ -27,16 +33,96 @@ class Color:
         return repr(self)
 
 
-def read_image_into_array(filename):
+class ColorGrid:
+    """
+    A view over an H×W×3 array of pixels that behaves like the 2D array of
+    colors returned by `read_image_into_array`: indexing gives a row, and
+    indexing a row gives a `Color`. Writing a `Color` into a row writes through
+    to the underlying array.
+
+    No pixel data is copied. `Color` objects are only created on access, so
+    this view is meant for compatibility, not for speed.
+    """
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, y):
+        return ColorRow(self.array[y])
+
+    def __iter__(self):
+        return (ColorRow(row) for row in self.array)
+
+
+class ColorRow:
+    """
+    A single row of a `ColorGrid`.
+    """
+
+    def __init__(self, row):
+        self.row = row
+
+    def __len__(self):
+        return self.row.shape[0]
+
+    def __getitem__(self, x):
+        # `tolist` gives back Python integers, so arithmetic on the components
+        # can't wrap around like 8-bit integers would.
+        r, g, b = self.row[x].tolist()
+        return Color(r, g, b)
+
+    def __setitem__(self, x, color):
+        self.row[x] = (color.r, color.g, color.b)
+
+    def __iter__(self):
+        return (Color(r, g, b) for r, g, b in self.row.tolist())
+
+
+def as_pixel_array(pixels):
+    """
+    Return the H×W×3 array behind the given pixels if there is one, or `None`
+    if the pixels are a plain 2D array of colors.
+    """
+
+    if isinstance(pixels, ColorGrid):
+        return pixels.array
+    if isinstance(pixels, np.ndarray):
+        return pixels
+    return None
+
+
+def colors_to_array(pixels):
+    """
+    Convert a 2D array of colors into an H×W×3 array of 8-bit RGB values.
+    """
+
+    return np.array(
+        [[(color.r, color.g, color.b) for color in row] for row in pixels],
+        dtype=np.uint8
+    )
+
+
+def read_image_into_array(filename, as_array=False):
     """
     Read the given image into a 2D array of pixels. The result is an array,
     where each element represents a row. Each row is an array, where each
     element is a color.
 
+    If `as_array` is set, the image is instead returned as a contiguous H×W×3
+    array of 8-bit RGB values, built directly from the decoded image buffer.
+    Wrap it in a `ColorGrid` to access it like a 2D array of colors.
+
     See: Color
     """
 
     img = Image.open(filename, 'r')
+
+    if as_array:
+        return np.array(img.convert('RGB'), dtype=np.uint8)
+
     w, h = img.size
 
     pixels = list(Color(*pixel) for pixel in img.getdata())
@@ -49,17 +135,22 @@ def write_array_into_image(pixels, filename):
     The input pixels are represented as an array, where each element is a row.
     Each row is an array, where each element is a color.
 
+    An H×W×3 array (or a `ColorGrid` over one) is also accepted, and is written
+    out in a single buffer operation.
+
     See: Color
     """
 
+    array = as_pixel_array(pixels)
+    if array is not None:
+        img = Image.fromarray(np.ascontiguousarray(array, dtype=np.uint8))
+        img.save(filename)
+        return
+
     h = len(pixels)
     w = len(pixels[0])
 
     img = Image.new('RGB', (w, h))
-
-    output_pixels = img.load()
-    for y, row in enumerate(pixels):
-        for x, color in enumerate(row):
-            output_pixels[x, y] = (color.r, color.g, color.b)
+    img.putdata([(color.r, color.g, color.b) for row in pixels for color in row])
 
     img.save(filename)
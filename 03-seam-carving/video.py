@@ -0,0 +1,171 @@
+"""
+Seam carving for a stream of video frames. Carving each frame on its own is
+slow, and makes the result jitter, because the seams of one frame can be far
+from the seams of the next one.
+
+Instead, each seam of a frame is searched for only within a narrow band around
+the same seam in the previous frame, which is both faster and keeps the seams
+steady over time. When the energy of a frame is too different from that of the
+previous one, as on a scene cut, the seams are searched for in the whole frame
+again.
+
+Frames are read from and written to iterators, and only a few frames are kept
+in memory at any time. Running this module carves an animated image (such as a
+GIF), saving each resulting frame as a separate image:
+
+    python3 video.py clip.gif 20 carved-{i}.png
+"""
+
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from pyramid import build_energy_pyramid
+from seam_v2 import compute_vertical_seam_in_band
+from utils import write_array_into_image
+from workspace import CarvingWorkspace
+
+
+class VideoCarver:
+    """
+    Removes the same number of vertical seams from each frame of a video,
+    keeping the seams coherent from one frame to the next.
+
+      - `band_radius` is how far, in pixels, a seam may move between frames.
+      - `max_energy_change` is how much the energy of a frame may differ from
+        that of the previous one before all the seams are searched for from
+        scratch. The energies are compared in blocks of 8×8 pixels, so that
+        small movements don't count, and the difference is relative to the
+        previous frame's average.
+
+    After carving, `frames_per_second` gives the throughput, counting only the
+    time spent carving, and `full_searches` the number of frames whose seams
+    were searched for in the whole frame.
+    """
+
+    def __init__(self, num_seams_to_remove, band_radius=4, max_energy_change=0.5):
+        self.num_seams_to_remove = num_seams_to_remove
+        self.band_radius = band_radius
+        self.max_energy_change = max_energy_change
+
+        self.frames = 0
+        self.seconds = 0
+        self.full_searches = 0
+
+        self._workspace = None
+        self._frame_shape = None
+        self._previous_block_energy = None
+        self._previous_seams = None
+
+    @property
+    def frames_per_second(self):
+        if self.seconds == 0:
+            return None
+        return self.frames / self.seconds
+
+    def carve(self, frames):
+        """
+        Carve each H×W×3 frame from the given iterable, yielding the carved
+        frames as they're done.
+        """
+
+        for frame in frames:
+            yield self.carve_frame(frame)
+
+    def carve_frame(self, pixels):
+        """
+        Carve a single H×W×3 frame, following on from the previous frame.
+        """
+
+        start = time.perf_counter()
+
+        if self._workspace is None or self._frame_shape != pixels.shape:
+            self._workspace = CarvingWorkspace(pixels)
+            self._frame_shape = pixels.shape
+            self._previous_block_energy = None
+            self._previous_seams = None
+        else:
+            self._workspace.reset(pixels)
+
+        workspace = self._workspace
+        energy_data = workspace.compute_energy()
+        block_energy = build_energy_pyramid(energy_data, 4, min_size=1)[-1]
+
+        follow_previous = self._previous_seams is not None and \
+            self._energy_change(block_energy) <= self.max_energy_change
+        self._previous_block_energy = block_energy
+
+        if not follow_previous:
+            self._previous_seams = np.empty(
+                (self.num_seams_to_remove, workspace.height),
+                dtype=np.intp
+            )
+            self.full_searches += 1
+
+        for i in range(self.num_seams_to_remove):
+            if follow_previous:
+                seam_xs, _ = compute_vertical_seam_in_band(
+                    workspace.energy,
+                    self._previous_seams[i] - self.band_radius,
+                    2 * self.band_radius + 1
+                )
+            else:
+                seam_xs, _ = workspace.find_seam()
+
+            self._previous_seams[i] = seam_xs
+            workspace.remove_seam(seam_xs)
+
+        # The workspace is reused for the next frame, so the result is copied.
+        carved_pixels = workspace.pixels.copy()
+
+        self.frames += 1
+        self.seconds += time.perf_counter() - start
+
+        return carved_pixels
+
+    def _energy_change(self, block_energy):
+        previous_block_energy = self._previous_block_energy
+        average_energy = previous_block_energy.mean()
+        if average_energy == 0:
+            return 0 if not block_energy.any() else np.inf
+
+        difference = np.abs(block_energy - previous_block_energy).mean()
+        return difference / average_energy
+
+
+def read_frames(filename):
+    """
+    Yield the frames of an animated image, such as a GIF, one at a time, each
+    as an H×W×3 array.
+    """
+
+    with Image.open(filename) as img:
+        for frame in ImageSequence.Iterator(img):
+            yield np.array(frame.convert('RGB'), dtype=np.uint8)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print(
+            f'USAGE: {__file__} '
+            '<input> <num-seams-to-remove> <output-pattern>'
+        )
+        sys.exit(1)
+
+    input_filename = sys.argv[1]
+    num_seams_to_remove = int(sys.argv[2])
+    output_pattern = sys.argv[3]
+
+    carver = VideoCarver(num_seams_to_remove)
+
+    frames = read_frames(input_filename)
+    for i, carved_pixels in enumerate(carver.carve(frames)):
+        output_filename = output_pattern.format(i=i)
+        print(f'Saving {output_filename}')
+        write_array_into_image(carved_pixels, output_filename)
+
+    print()
+    print(f'Frames: {carver.frames} ({carver.full_searches} full searches)')
+    print(f'Throughput: {carver.frames_per_second:.2f} frames per second')
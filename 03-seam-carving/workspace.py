@@ -0,0 +1,349 @@
+"""
+A workspace for removing many seams from the same image without allocating
+memory for every seam. All the buffers needed by the seam carving process are
+allocated once, at the size of the original image, and the image only shrinks
+logically: removing a vertical seam moves the pixels to the right of it one
+position to the left, within each row, and reduces the width in use by one.
+
+Horizontal seams are handled by the same code, working on a transposed view of
+the buffers. Transposing an array only swaps its strides, so no pixels are
+copied: a horizontal seam is found and removed as a vertical seam of the
+transposed view, moving pixels up within each column.
+
+The workspace is used by `remove_n_lowest_seams_from_image` in the `carve`
+module whenever the image is an array.
+
+Given several workers, the seams of wide images are searched for with the
+tiled version of the recurrence (see `seam_tiled`), which splits each row into
+tiles of columns handled by a pool of threads. The pool belongs to the
+workspace, and is shut down by `close`.
+"""
+
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from energy import (
+    compute_energy_array,
+    compute_energy_at,
+    get_energy_kernel,
+    positions_next_to_seam,
+)
+from profiling import NULL_PROFILER
+from seam_tiled import compute_seam_offsets_tiled
+from seam_v2 import backtrack_seam, compute_seam_offsets, cumulative_dtype
+
+
+# The narrowest tiles the seam search is split into when there are several
+# workers. Each tile also processes a halo of columns on either side, so
+# narrower tiles spend more of their time on work that is thrown away. Images
+# narrower than two tiles are searched on a single thread.
+TILED_MIN_TILE_WIDTH = 2048
+
+
+class CarvingWorkspace:
+    """
+    Preallocated buffers for carving seams out of an H×W×3 array of pixels:
+
+      - The pixels and their energies, of which only the first `height` rows
+        and `width` columns are in use.
+      - A padded copy of the pixels and a scratch array, used to compute the
+        energies of the whole image without allocating any memory.
+      - The back pointer offsets and the two rows of total seam energies used
+        to find seams, along with a boolean scratch row. The offsets for
+        horizontal seams are only allocated once one is searched for.
+      - The coordinates of the last seam found in each direction.
+      - Scratch rows used to move pixels and energies within a row or column.
+
+    Methods taking a `transposed` argument work on horizontal seams when it's
+    set, in which case the seam is given by its y-coordinate in each column,
+    from left to right.
+
+    The energy is measured by the given `kernel`, an `EnergyKernel` from the
+    `energy` module or its name. The energies in the workspace are always
+    those of the image as it is, not transposed.
+
+    The time spent in each stage of finding and removing seams is recorded by
+    `profiler` (see the `profiling` module), which does nothing by default.
+
+    With more than one of `workers` (`None` meaning one per core), seams are
+    searched for on that many threads whenever the image is at least two
+    tiles of `TILED_MIN_TILE_WIDTH` wide, in the direction of the seam.
+
+    The pixels passed in are copied, and are not modified.
+    """
+
+    def __init__(
+        self,
+        pixels,
+        kernel='gradient',
+        profiler=NULL_PROFILER,
+        workers=1
+    ):
+        h, w = pixels.shape[:2]
+        n = max(h, w)
+
+        self.height = h
+        self.width = w
+        self.kernel = get_energy_kernel(kernel)
+        self.profiler = profiler
+        self.workers = os.cpu_count() if workers is None else workers
+
+        self._executor = None
+
+        self._pixels = np.array(pixels)
+        self._energy = np.empty((h, w), dtype=self.kernel.dtype)
+
+        r = self.kernel.radius
+        self._padded = np.empty((h + 2 * r, w + 2 * r) + self._pixels.shape[2:],
+                                dtype=self._pixels.dtype)
+        self._energy_products = np.empty((h, w), dtype=np.int32)
+
+        self._offsets = np.empty((h, w), dtype=np.int8)
+        self._offsets_transposed = None
+        self._rows = np.empty((2, n), dtype=cumulative_dtype(self._energy))
+        self._mask = np.empty(n, dtype=bool)
+        self._seam_xs = np.empty(h, dtype=np.intp)
+        self._seam_ys = np.empty(w, dtype=np.intp)
+
+        self._pixels_scratch = np.empty((n,) + self._pixels.shape[2:],
+                                        dtype=self._pixels.dtype)
+        self._energy_scratch = np.empty(n, dtype=self._energy.dtype)
+
+    def reset(self, pixels):
+        """
+        Start over with a new image of the same size as the original one,
+        reusing all the buffers. The pixels passed in are copied.
+        """
+
+        self._pixels[:] = pixels
+        self.height, self.width = self._pixels.shape[:2]
+
+    @property
+    def pixels(self):
+        """
+        The pixels of the image at its current size. This is a view into the
+        workspace, and changes as seams are removed.
+        """
+
+        return self._pixels[:self.height, :self.width]
+
+    @property
+    def energy(self):
+        """
+        The energies of the image at its current size. This is a view into the
+        workspace, and changes as seams are removed.
+        """
+
+        return self._energy[:self.height, :self.width]
+
+    def view(self, transposed=False):
+        """
+        The pixels and the energies of the image at its current size, either
+        as they are, or transposed so that horizontal seams become vertical.
+        """
+
+        if transposed:
+            return (self.pixels.transpose(1, 0, 2), self.energy.T)
+        return (self.pixels, self.energy)
+
+    def compute_energy(self):
+        """
+        Compute the energy of the whole image at its current size.
+        """
+
+        h, w = self.height, self.width
+        r = self.kernel.radius
+
+        with self.profiler.stage('energy'):
+            compute_energy_array(
+                self.pixels,
+                self.kernel,
+                out=self.energy,
+                padded=self._padded[:h + 2 * r, :w + 2 * r],
+                scratch=self._energy_products[:h, :w]
+            )
+        return self.energy
+
+    def find_seam(self, transposed=False):
+        """
+        Find the lowest-energy vertical seam in the image at its current size,
+        or the lowest-energy horizontal seam if `transposed` is set, using the
+        energies already in the workspace.
+
+        Returns the same tuple as `compute_vertical_seam_array`, except that
+        the array of coordinates belongs to the workspace and is overwritten by
+        the next call in the same direction.
+
+        If the kernel isn't symmetric, the energies kept in the workspace don't
+        apply to horizontal seams, and those of the transposed image are
+        computed in full instead. If it has transition costs, they are
+        computed by the seam search, one row at a time.
+        """
+
+        kernel = self.kernel
+        pixels, energy = self.view(transposed)
+        n, w = energy.shape
+
+        if transposed and not kernel.symmetric:
+            energy = compute_energy_array(pixels, kernel)
+
+        if kernel.has_transition_costs:
+            transition_costs = \
+                functools.partial(kernel.transition_costs_row, pixels)
+        else:
+            transition_costs = None
+
+        if transposed:
+            if self._offsets_transposed is None:
+                self._offsets_transposed = np.empty(
+                    self._energy.shape[::-1],
+                    dtype=np.int8
+                )
+            offsets = self._offsets_transposed
+            seam = self._seam_ys
+        else:
+            offsets = self._offsets
+            seam = self._seam_xs
+
+        num_tiles = min(self.workers, w // TILED_MIN_TILE_WIDTH)
+
+        with self.profiler.stage('dp'):
+            if num_tiles > 1:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers)
+                offsets, last_row = compute_seam_offsets_tiled(
+                    energy,
+                    tile_width=-(-w // num_tiles),
+                    executor=self._executor,
+                    transition_costs=transition_costs,
+                    offsets=offsets[:n, :w],
+                    rows=self._rows[:, :w]
+                )
+            else:
+                offsets, last_row = compute_seam_offsets(
+                    energy,
+                    offsets[:n, :w],
+                    self._rows[:, :w],
+                    self._mask[:w],
+                    transition_costs
+                )
+
+        with self.profiler.stage('backtrack'):
+            min_end = int(np.argmin(last_row))
+            seam = backtrack_seam(offsets, min_end, seam[:n])
+
+        return (seam, last_row[min_end].item())
+
+    def close(self):
+        """
+        Shut down the threads used to search for seams, if any were started.
+        The workspace can still be used afterwards, and starts new ones if
+        needed.
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def remove_seam(self, seam, update_energy=True, transposed=False):
+        """
+        Remove the given vertical seam from the image, shifting the rest of
+        each row to the left, or the given horizontal seam if `transposed` is
+        set, shifting the rest of each column up.
+
+        If `update_energy` is set, the energies are shifted along with the
+        pixels, and only the energies next to the seam are recomputed, as in
+        `update_energy_after_seam_removal` in the `carve` module. Otherwise,
+        the energies are left for `compute_energy` to recompute.
+        """
+
+        pixels, energy = self.view(transposed)
+        w = pixels.shape[1]
+
+        with self.profiler.stage('removal'):
+            for y, seam_x in enumerate(seam):
+                n = w - 1 - seam_x
+                _shift_left(pixels[y], seam_x, n, self._pixels_scratch)
+                if update_energy:
+                    _shift_left(energy[y], seam_x, n, self._energy_scratch)
+
+            if transposed:
+                self.height -= 1
+            else:
+                self.width -= 1
+
+        if update_energy:
+            with self.profiler.stage('energy'):
+                ys, xs = \
+                    positions_next_to_seam(seam, w - 1, self.kernel.radius)
+                if transposed:
+                    ys, xs = xs, ys
+
+                self.energy[ys, xs] = \
+                    compute_energy_at(self.pixels, ys, xs, self.kernel)
+
+
+class PixelBuffer:
+    """
+    The pixels of an H×W×3 image that seams are removed from in place, as in
+    `CarvingWorkspace`, but without any of the buffers needed to find seams.
+    This is all that's needed to follow the removal of seams found elsewhere.
+
+    The pixels passed in are copied, and are not modified.
+    """
+
+    def __init__(self, pixels):
+        h, w = pixels.shape[:2]
+
+        self.height = h
+        self.width = w
+
+        self._pixels = np.array(pixels)
+        self._scratch = np.empty((max(h, w),) + self._pixels.shape[2:],
+                                 dtype=self._pixels.dtype)
+
+    @property
+    def pixels(self):
+        """
+        The pixels of the image at its current size. This is a view into the
+        buffer, and changes as seams are removed.
+        """
+
+        return self._pixels[:self.height, :self.width]
+
+    def view(self, transposed=False):
+        """
+        The pixels of the image at its current size, either as they are, or
+        transposed so that horizontal seams become vertical.
+        """
+
+        if transposed:
+            return self.pixels.transpose(1, 0, 2)
+        return self.pixels
+
+    def remove_seam(self, seam, transposed=False):
+        """
+        Remove the given vertical seam from the image, or the given horizontal
+        seam if `transposed` is set, as in `CarvingWorkspace.remove_seam`.
+        """
+
+        pixels = self.view(transposed)
+        w = pixels.shape[1]
+
+        for y, seam_x in enumerate(seam):
+            _shift_left(pixels[y], seam_x, w - 1 - seam_x, self._scratch)
+
+        if transposed:
+            self.height -= 1
+        else:
+            self.width -= 1
+
+
+def _shift_left(row, x, n, scratch):
+    # Moves the `n` elements after position `x` one position to the left,
+    # going through a scratch row because the two ranges overlap.
+    scratch[:n] = row[x + 1:x + 1 + n]
+    row[x:x + n] = scratch[:n]
@@ -0,0 +1,237 @@
+"""
+Decoding many sequences of observations at once. The sequences are encoded
+into a single padded array, with one row per sequence, and the Viterbi
+algorithm runs over all of them together: each time step is one max-plus
+operation for the whole batch (see `viterbi_step` in `viterbi`).
+
+Sequences of different lengths are handled with a mask. Once a sequence has
+ended, its path probabilities are carried over unchanged, and each state's back
+pointer points to the same state, so backtracking from the last time step
+passes straight through the padding. Sequences are sorted by length first, so
+that the ones still running are always at the start of the batch, and only
+those are computed at each step.
+
+Large batches can be split into shards, and decoded on several processes. The
+compiled model is sent to each worker process once, when it starts, and is only
+read from there on.
+
+This file can be run directly to compare batch decoding against decoding each
+sequence separately:
+
+    python3 batch.py 10000
+"""
+
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model import SPEECH_RECOGNITION_HMM, compile_hmm
+from viterbi import choose_engine, viterbi, viterbi_step
+
+
+def encode_batch(compiled, sequences):
+    """
+    Encode sequences of observations, of any lengths, for a `CompiledHMM`.
+    Returns a tuple with two values:
+
+      1. A B×T array of observation numbers, where T is the length of the
+         longest sequence. Shorter sequences are padded with 0.
+      2. The length of each sequence.
+    """
+
+    lengths = np.array(
+        [len(sequence) for sequence in sequences],
+        dtype=np.int32
+    )
+    num_steps = int(lengths.max()) if lengths.size else 0
+
+    observations = np.zeros((len(sequences), num_steps), dtype=np.int32)
+    for i, sequence in enumerate(sequences):
+        observations[i, :lengths[i]] = compiled.encode(sequence)
+
+    return (observations, lengths)
+
+
+def viterbi_batch_indices(compiled, observations, lengths, engine='auto'):
+    """
+    The Viterbi algorithm on a `CompiledHMM` for a batch of sequences, given
+    as returned by `encode_batch`.
+
+    Returns a tuple with two values:
+
+      1. A B×T array with the state numbers on the most probable path of each
+         sequence, padded with -1 past the end of the sequence.
+      2. The log-probability of each of those paths (0 for empty sequences).
+    """
+
+    engine = choose_engine(compiled, engine)
+
+    batch_size, num_steps = observations.shape
+    n = compiled.num_states
+
+    paths = np.full((batch_size, num_steps), -1, dtype=np.int32)
+    log_probabilities = np.zeros(batch_size, dtype=np.float64)
+    if batch_size == 0 or num_steps == 0:
+        return (paths, log_probabilities)
+
+    # Sorted from longest to shortest, the sequences still running at step t
+    # are the first `active[t]` ones.
+    order = np.argsort(-lengths, kind='stable')
+    observations = observations[order]
+    lengths = lengths[order]
+    active = (lengths > np.arange(num_steps)[:, np.newaxis]).sum(axis=1)
+
+    emissions = compiled.log_b.T
+
+    # Back pointers start out as the identity, which is what the sequences
+    # that have ended keep.
+    back_pointers = np.empty((num_steps, batch_size, n), dtype=np.int32)
+    back_pointers[:] = np.arange(n, dtype=np.int32)
+
+    scores = compiled.log_p + emissions[observations[:, 0]]
+
+    for t in range(1, num_steps):
+        k = active[t]
+        if k == 0:
+            break
+
+        step_scores, back_pointers[t, :k] = \
+            viterbi_step(compiled, scores[:k], engine)
+        scores[:k] = step_scores + emissions[observations[:k, t]]
+
+    end_states = scores.argmax(axis=1)
+    sorted_log_probabilities = scores[np.arange(batch_size), end_states]
+
+    sorted_paths = np.empty((batch_size, num_steps), dtype=np.int32)
+    rows = np.arange(batch_size)
+    states = end_states.astype(np.int32)
+    for t in range(num_steps - 1, -1, -1):
+        sorted_paths[:, t] = states
+        states = back_pointers[t, rows, states]
+
+    sorted_paths[np.arange(num_steps) >= lengths[:, np.newaxis]] = -1
+    sorted_log_probabilities[lengths == 0] = 0
+
+    paths[order] = sorted_paths
+    log_probabilities[order] = sorted_log_probabilities
+
+    return (paths, log_probabilities)
+
+
+def viterbi_batch(
+    hmm,
+    sequences,
+    engine='auto',
+    shard_size=1024,
+    workers=None
+):
+    """
+    Given a Hidden Markov Model, either an `HMM` or a `CompiledHMM`, and a list
+    of sequences of observations, find the most probable sequence of states
+    for each of them. The paths are the same as calling `viterbi` on each
+    sequence.
+
+    The sequences are decoded in shards of `shard_size`, which bounds the
+    memory used by the back pointers. If `workers` is given, the shards are
+    decoded on a pool of that many processes.
+    """
+
+    compiled = compile_hmm(hmm)
+
+    shards = [
+        encode_batch(compiled, sequences[i:i + shard_size])
+        for i in range(0, len(sequences), shard_size)
+    ]
+
+    if workers is None:
+        results = [
+            viterbi_batch_indices(compiled, observations, lengths, engine)
+            for observations, lengths in shards
+        ]
+    else:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_set_worker_model,
+            initargs=(compiled,)
+        ) as executor:
+            results = list(executor.map(
+                _decode_shard,
+                [observations for observations, _ in shards],
+                [lengths for _, lengths in shards],
+                [engine] * len(shards)
+            ))
+
+    paths = []
+    for (_, lengths), (shard_paths, _) in zip(shards, results):
+        for path, length in zip(shard_paths, lengths):
+            paths.append(compiled.decode(path[:length]))
+
+    return paths
+
+
+# The model used by each worker process, set once when the process starts.
+_worker_model = None
+
+
+def _set_worker_model(compiled):
+    global _worker_model
+    _worker_model = compiled
+
+
+def _decode_shard(observations, lengths, engine):
+    return viterbi_batch_indices(_worker_model, observations, lengths, engine)
+
+
+def greedy_batch(hmm, sequences):
+    """
+    The greedy algorithm (see `greedy` in `viterbi`) for a list of sequences
+    of observations. The most probable state for each observation is looked
+    up once, and every sequence is then decoded with a single lookup.
+    """
+
+    compiled = compile_hmm(hmm)
+    most_probable_states = compiled.log_b.argmax(axis=0)
+
+    observations, lengths = encode_batch(compiled, sequences)
+    paths = most_probable_states[observations]
+
+    return [
+        compiled.decode(path[:length])
+        for path, length in zip(paths, lengths)
+    ]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print(f'USAGE: {__file__} [<num-sequences>]')
+        sys.exit(1)
+
+    num_sequences = int(sys.argv[1]) if len(sys.argv) == 2 else 10000
+
+    compiled = SPEECH_RECOGNITION_HMM.compile()
+
+    rng = np.random.default_rng(0)
+    sequences = [
+        [
+            compiled.observations[o]
+            for o in rng.integers(0, len(compiled.observations), length)
+        ]
+        for length in rng.integers(1, 12, num_sequences)
+    ]
+
+    start = time.perf_counter()
+    expected_paths = [
+        viterbi(SPEECH_RECOGNITION_HMM, sequence) for sequence in sequences
+    ]
+    print(f'One at a time: {time.perf_counter() - start:.3f}s')
+
+    start = time.perf_counter()
+    paths = viterbi_batch(compiled, sequences)
+    print(f'Batch:         {time.perf_counter() - start:.3f}s')
+
+    mismatches = sum(
+        path != expected for path, expected in zip(paths, expected_paths)
+    )
+    print(f'Mismatches:    {mismatches}')
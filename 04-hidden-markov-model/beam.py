@@ -0,0 +1,308 @@
+"""
+Decoding with models that have too many states to score every one of them at
+every time step. Beam search keeps only the most probable paths at each step,
+the active hypotheses, and only follows the transitions out of those states
+(see `CompiledHMM.successors`). Paths that fall out of the beam are dropped for
+good, so the result is no longer guaranteed to be the most probable path, but
+the work done at each step only depends on the size of the beam.
+
+There are two ways of limiting the beam, which can be used together:
+
+  - `beam_size` keeps at most that many states, the most probable ones.
+  - `beam_threshold` drops every state whose path is less probable than the
+    best one by more than that much, as a difference of log-probabilities.
+
+Without any limit, every state with a nonzero path probability is kept, and
+the path is the same as the one `viterbi_indices` finds.
+
+This file can be run directly to measure how often beam search disagrees with
+the exact algorithm on generated sequences, for a few beam sizes:
+
+    python3 beam.py 10000 20
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from model import compile_hmm
+from synthetic import random_sparse_hmm, sample_observations
+from viterbi import viterbi_indices
+
+
+def beam_viterbi(hmm, observations, beam_size=None, beam_threshold=None):
+    """
+    Given a Hidden Markov Model, either an `HMM` or a `CompiledHMM`, and a
+    sequence of observations, finds a probable sequence of states that
+    produced the observations, using beam search (see
+    `beam_viterbi_indices`).
+    """
+
+    compiled = compile_hmm(hmm)
+    path, _, _ = beam_viterbi_indices(
+        compiled,
+        compiled.encode(observations),
+        beam_size,
+        beam_threshold
+    )
+    return compiled.decode(path)
+
+
+def beam_viterbi_indices(
+    compiled,
+    observations,
+    beam_size=None,
+    beam_threshold=None
+):
+    """
+    The Viterbi algorithm with beam search on a `CompiledHMM`, given the
+    observations as an array of their numbers (see `CompiledHMM.encode`).
+
+    Returns a tuple with three values:
+
+      1. The array of state numbers on the most probable path that stayed in
+         the beam.
+      2. The log-probability of that path.
+      3. The number of states dropped from the beam at each time step, not
+         counting those whose path probability was already 0.
+
+    Raises a `ValueError` if no path is left, either because every path has a
+    probability of 0, or because the beam dropped all those that didn't.
+    """
+
+    if beam_size is not None and beam_size < 1:
+        raise ValueError('The beam size must be at least 1')
+
+    num_steps = len(observations)
+    pruned = np.zeros(num_steps, dtype=np.int64)
+    if num_steps == 0:
+        return (np.empty(0, dtype=np.int32), 0.0, pruned)
+
+    successors = compiled.successors
+    log_b = compiled.log_b
+
+    states = np.arange(compiled.num_states, dtype=np.int32)
+    parents = np.zeros(compiled.num_states, dtype=np.int32)
+    scores = compiled.log_p + log_b[:, observations[0]]
+
+    # The states kept at each time step, in increasing order, along with the
+    # state each of their paths comes from.
+    history = []
+
+    for t in range(num_steps):
+        if t > 0:
+            states, parents, scores = \
+                expand_hypotheses(successors, states, scores)
+            scores += log_b[states, observations[t]]
+
+        kept, pruned[t] = prune_hypotheses(scores, beam_size, beam_threshold)
+        states = states[kept]
+        parents = parents[kept]
+        scores = scores[kept]
+
+        if states.size == 0:
+            raise ValueError(f'No path is left at time step {t}')
+
+        history.append((states, parents))
+
+    # The states are in increasing order, so ties go to the earliest state.
+    best = int(scores.argmax())
+
+    path = np.empty(num_steps, dtype=np.int32)
+    state = states[best]
+    for t in range(num_steps - 1, -1, -1):
+        path[t] = state
+        step_states, step_parents = history[t]
+        state = step_parents[np.searchsorted(step_states, state)]
+
+    return (path, scores[best].item(), pruned)
+
+
+def expand_hypotheses(successors, states, scores):
+    """
+    Follow the transitions out of each of the given states, whose paths have
+    the given log-probabilities, using the successor lists of the model (see
+    `TransitionLists`). Only the best path into each state reached is kept,
+    with ties going to the earliest previous state, as in `viterbi_step`.
+
+    Returns a tuple with three arrays: the states reached, in increasing
+    order, the state each of their best paths comes from, and the
+    log-probability of those paths, before the emission probabilities are
+    added.
+    """
+
+    starts = successors.indptr[states]
+    counts = successors.indptr[states + 1] - starts
+    total = int(counts.sum())
+
+    # The position of every transition out of the given states, one list
+    # after the other.
+    list_starts = np.cumsum(counts) - counts
+    positions = np.repeat(starts - list_starts, counts) + np.arange(total)
+
+    targets = successors.indices[positions]
+    sources = np.repeat(states, counts)
+    values = np.repeat(scores, counts) + successors.log_probabilities[positions]
+
+    # Sorted by target, then from the best path to the worst, then by previous
+    # state, the first transition into each target is the one kept.
+    order = np.lexsort((sources, -values, targets))
+    targets = targets[order]
+
+    first = np.ones(total, dtype=bool)
+    first[1:] = targets[1:] != targets[:-1]
+    best = order[first]
+
+    return (targets[first], sources[best], values[best])
+
+
+def prune_hypotheses(scores, beam_size=None, beam_threshold=None):
+    """
+    Choose which paths to keep in the beam, given their log-probabilities.
+    Paths with a probability of 0 are always dropped. Among paths that are
+    equally probable, those ending at earlier positions are kept first.
+
+    Returns a tuple with two values: the positions of the paths kept, in
+    increasing order, and the number of paths with a nonzero probability
+    that were dropped.
+    """
+
+    keep = scores > -np.inf
+    num_possible = int(np.count_nonzero(keep))
+
+    if beam_threshold is not None and num_possible > 0:
+        keep &= scores >= scores[keep].max() - beam_threshold
+
+    kept = np.flatnonzero(keep)
+
+    if beam_size is not None and kept.size > beam_size:
+        order = np.lexsort((kept, -scores[kept]))
+        kept = np.sort(kept[order[:beam_size]])
+
+    return (kept, num_possible - kept.size)
+
+
+def measure_disagreement(
+    hmm,
+    sequences,
+    beam_size=None,
+    beam_threshold=None,
+    engine='auto'
+):
+    """
+    Decode each sequence of observation numbers with both beam search and the
+    exact algorithm (see `viterbi_indices`), and compare the results. Returns
+    a dictionary with:
+
+      - 'sequences': the number of sequences.
+      - 'disagreements': how many of them beam search found a different path
+        for, including those where no path was left.
+      - 'failures': how many of them had no path left at all.
+      - 'state_error_rate': the fraction of time steps where the state on the
+        beam search path is different, with failures counting as wrong
+        everywhere.
+      - 'mean_log_probability_loss': how much less probable the beam search
+        paths are than the exact ones on average, as a difference of
+        log-probabilities, leaving out failures.
+      - 'mean_pruned': the average number of states dropped per time step.
+      - 'exact_seconds' and 'beam_seconds': the time spent decoding with each
+        algorithm.
+    """
+
+    compiled = compile_hmm(hmm)
+
+    disagreements = 0
+    failures = 0
+    state_errors = 0
+    num_steps = 0
+    log_probability_losses = []
+    total_pruned = 0
+    exact_seconds = 0
+    beam_seconds = 0
+
+    for observations in sequences:
+        start = time.perf_counter()
+        expected_path, expected_log_probability = \
+            viterbi_indices(compiled, observations, engine)
+        exact_seconds += time.perf_counter() - start
+
+        num_steps += len(observations)
+
+        start = time.perf_counter()
+        try:
+            path, log_probability, pruned = beam_viterbi_indices(
+                compiled,
+                observations,
+                beam_size,
+                beam_threshold
+            )
+        except ValueError:
+            beam_seconds += time.perf_counter() - start
+            disagreements += 1
+            failures += 1
+            state_errors += len(observations)
+            continue
+        beam_seconds += time.perf_counter() - start
+
+        errors = int(np.count_nonzero(path != expected_path))
+        disagreements += errors > 0
+        state_errors += errors
+        log_probability_losses.append(
+            expected_log_probability - log_probability
+        )
+        total_pruned += int(pruned.sum())
+
+    return {
+        'sequences': len(sequences),
+        'disagreements': disagreements,
+        'failures': failures,
+        'state_error_rate': state_errors / max(num_steps, 1),
+        'mean_log_probability_loss': (
+            float(np.mean(log_probability_losses))
+            if log_probability_losses else 0.0
+        ),
+        'mean_pruned': total_pruned / max(num_steps, 1),
+        'exact_seconds': exact_seconds,
+        'beam_seconds': beam_seconds,
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print(
+            f'USAGE: {__file__} '
+            '<num-states> <num-sequences> [<beam-threshold>]'
+        )
+        sys.exit(1)
+
+    num_states = int(sys.argv[1])
+    num_sequences = int(sys.argv[2])
+    beam_threshold = float(sys.argv[3]) if len(sys.argv) == 4 else None
+
+    print(f'Generating a model with {num_states} states...')
+    compiled = random_sparse_hmm(num_states, 50, successors=8)
+    sequences = [
+        sample_observations(compiled, 200, seed=i)[0]
+        for i in range(num_sequences)
+    ]
+
+    print(f'{"Beam size":>10} {"Disagree":>9} {"Failed":>7} '
+          f'{"State errors":>13} {"Pruned/step":>12} {"Speedup":>8}')
+
+    for beam_size in (10, 30, 100, 300, 1000, None):
+        results = measure_disagreement(
+            compiled,
+            sequences,
+            beam_size,
+            beam_threshold
+        )
+        speedup = results['exact_seconds'] / results['beam_seconds']
+        print(
+            f'{beam_size or "-":>10} '
+            f'{results["disagreements"]:>9} '
+            f'{results["failures"]:>7} '
+            f'{results["state_error_rate"]:>13.2%} '
+            f'{results["mean_pruned"]:>12.1f} '
+            f'{speedup:>7.2f}x'
+        )
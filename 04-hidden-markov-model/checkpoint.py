@@ -0,0 +1,174 @@
+"""
+The exact Viterbi algorithm for sequences too long to keep every back pointer
+in memory.
+
+`viterbi_indices` keeps one row of back pointers per time step, which takes
+T×S integers. Here, the forward pass only keeps its row of path
+log-probabilities every `interval` time steps, as a checkpoint, and throws the
+back pointers away. Backtracking then goes through the sequence one segment
+at a time, from the last to the first: the rows of back pointers of a segment
+are recomputed from the checkpoint at its start, and followed from the state
+already found at its end.
+
+This takes T/k rows of log-probabilities and k rows of back pointers for an
+interval of k, at the cost of running every time step twice. By default, k is
+the square root of T, so memory grows with the square root of the length of
+the sequence. The recomputed steps do the exact same arithmetic as the forward
+pass, so the path is the same as the one `viterbi_indices` finds, ties
+included.
+
+This file can be run directly to compare the memory used by both versions on
+a long generated sequence:
+
+    python3 checkpoint.py 100000
+"""
+
+import math
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from synthetic import random_sparse_hmm, sample_observations
+from viterbi import backtrack_path, choose_engine, viterbi_indices, viterbi_step
+
+
+def checkpointed_viterbi_indices(
+    compiled,
+    observations,
+    interval=None,
+    engine='auto'
+):
+    """
+    The Viterbi algorithm on a `CompiledHMM`, given the observations as an
+    array of their numbers (see `CompiledHMM.encode`), keeping a checkpoint
+    every `interval` time steps instead of every back pointer. By default, the
+    interval is the square root of the number of observations. Smaller
+    intervals keep more checkpoints and fewer back pointers at once.
+
+    Returns the same tuple as `viterbi_indices`.
+    """
+
+    engine = choose_engine(compiled, engine)
+
+    num_steps = len(observations)
+    if num_steps == 0:
+        return (np.empty(0, dtype=np.int32), 0.0)
+
+    if interval is None:
+        interval = default_interval(num_steps)
+    if interval < 1:
+        raise ValueError('The checkpoint interval must be at least 1')
+
+    emissions = compiled.log_b.T
+
+    # The path log-probabilities at every `interval` time steps, starting from
+    # the first one.
+    checkpoints = np.empty(
+        ((num_steps - 1) // interval + 1, compiled.num_states),
+        dtype=np.float64
+    )
+
+    scores = compiled.log_p + emissions[observations[0]]
+    checkpoints[0] = scores
+
+    for t in range(1, num_steps):
+        scores, _ = viterbi_step(compiled, scores, engine)
+        scores += emissions[observations[t]]
+        if t % interval == 0:
+            checkpoints[t // interval] = scores
+
+    end_state = int(scores.argmax())
+    log_probability = scores[end_state].item()
+
+    path = np.empty(num_steps, dtype=np.int32)
+    back_pointers = np.empty(
+        (interval + 1, compiled.num_states),
+        dtype=np.int32
+    )
+    back_pointers[0] = 0
+
+    state = end_state
+    for i in range(checkpoints.shape[0] - 1, -1, -1):
+        # The segment goes from the checkpoint to the next one, which is where
+        # the state is already known, or to the last time step.
+        start = i * interval
+        end = min(start + interval, num_steps - 1)
+
+        scores = checkpoints[i]
+        for t in range(start + 1, end + 1):
+            scores, back_pointers[t - start] = \
+                viterbi_step(compiled, scores, engine)
+            scores += emissions[observations[t]]
+
+        path[start:end + 1] = \
+            backtrack_path(back_pointers[:end - start + 1], state)
+        state = path[start]
+
+    return (path, log_probability)
+
+
+def default_interval(num_steps):
+    """
+    The interval between checkpoints that uses the least memory for a
+    sequence of the given length: its square root, rounded up.
+    """
+
+    return max(math.ceil(math.sqrt(num_steps)), 1)
+
+
+def checkpoint_memory(num_steps, num_states, interval=None):
+    """
+    The number of bytes taken by the checkpoints and back pointers of
+    `checkpointed_viterbi_indices`, for a sequence of the given length.
+    """
+
+    if interval is None:
+        interval = default_interval(num_steps)
+
+    num_checkpoints = (num_steps - 1) // interval + 1
+    return num_states * (8 * num_checkpoints + 4 * (interval + 1))
+
+
+def _measure(decode, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = decode(*args)
+    seconds = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (result, seconds, peak_memory)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(f'USAGE: {__file__} <num-observations> [<interval>]')
+        sys.exit(1)
+
+    num_observations = int(sys.argv[1])
+    interval = int(sys.argv[2]) if len(sys.argv) == 3 else None
+
+    compiled = random_sparse_hmm(200, 30)
+    observations, _ = sample_observations(compiled, num_observations)
+
+    (expected_path, expected_log_probability), full_seconds, full_memory = \
+        _measure(viterbi_indices, compiled, observations)
+    print(f'Full table:   {full_seconds:.3f}s, '
+          f'{full_memory / 1024 ** 2:.1f} MiB')
+
+    (path, log_probability), seconds, memory = _measure(
+        checkpointed_viterbi_indices,
+        compiled,
+        observations,
+        interval
+    )
+    expected_memory = checkpoint_memory(num_observations, 200, interval)
+    print(f'Checkpointed: {seconds:.3f}s, {memory / 1024 ** 2:.1f} MiB '
+          f'({expected_memory / 1024 ** 2:.1f} MiB for checkpoints and back '
+          'pointers)')
+
+    assert np.array_equal(path, expected_path)
+    assert log_probability == expected_log_probability
+    print('Same path:    yes')
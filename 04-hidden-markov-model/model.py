@@ -2,8 +2,19 @@
 This file contains the representation of a Hidden Markov Model as a Python
 class. While this file can't be used directly, the model is used by the Viterbi
 algorithm.
+
+A model can also be compiled into arrays, with the states and observations
+numbered and the probabilities stored as logarithms, for the faster versions of
+the algorithms.
 """
 
+import numpy as np
+
+
+# Models with at most this fraction of nonzero transitions are compiled, and
+# decoded, as sparse models.
+SPARSE_DENSITY = 0.25
+
 
 class HMM:
     """
@@ -28,6 +39,335 @@ class HMM:
         # observations, we don't need to store the possible observations.
         self.possible_states = p.keys()
 
+    def compile(self, sparse=None):
+        """
+        Number the states, in the same order as `possible_states`, and the
+        observations, in the order they first appear in the emission
+        probabilities, and store the probabilities as arrays of logarithms.
+        Missing probabilities are treated as 0.
+
+        If `sparse` is set, the transition probabilities are only stored as
+        lists of the nonzero ones (see `TransitionLists`), which is all that
+        large models with few transitions per state can afford. By default,
+        that's done when at most `SPARSE_DENSITY` of the transitions are
+        nonzero.
+        """
+
+        states = list(self.possible_states)
+        state_index = {s: i for i, s in enumerate(states)}
+        n = len(states)
+
+        observations = []
+        seen = set()
+        for s in states:
+            for observation in self.b[s]:
+                if observation not in seen:
+                    seen.add(observation)
+                    observations.append(observation)
+
+        p = np.array([self.p[s] for s in states], dtype=np.float64)
+        b = np.array([
+            [self.b[s].get(observation, 0) for observation in observations]
+            for s in states
+        ], dtype=np.float64).reshape(n, len(observations))
+
+        # The nonzero transitions, as (from, to, probability).
+        transitions = [
+            (state_index[r], state_index[s], probability)
+            for r in states
+            for s, probability in self.a.get(r, {}).items()
+            if probability != 0
+        ]
+
+        if sparse is None:
+            sparse = len(transitions) <= SPARSE_DENSITY * n * n
+
+        if sparse:
+            sources, targets, probabilities = \
+                zip(*transitions) if transitions else ((), (), ())
+            log_a = None
+            predecessors = TransitionLists.from_pairs(
+                n,
+                targets,
+                sources,
+                log_probabilities(np.array(probabilities, dtype=np.float64))
+            )
+        else:
+            a = np.zeros((n, n), dtype=np.float64)
+            for r, s, probability in transitions:
+                a[r, s] = probability
+            log_a = log_probabilities(a)
+            predecessors = None
+
+        return CompiledHMM(
+            states,
+            observations,
+            log_probabilities(p),
+            log_a,
+            log_probabilities(b),
+            predecessors
+        )
+
+
+class TransitionLists:
+    """
+    For each state, the list of the states it has a nonzero transition with,
+    in one direction, along with the log-probability of each transition. The
+    lists are stored one after the other, in compressed sparse row form:
+
+      - `indices[indptr[s]:indptr[s + 1]]` lists the other state of each of
+        the transitions of state s, in increasing order.
+      - `log_probabilities` holds the log-probability of each transition, in
+        the same order as `indices`.
+
+    Whether the lists hold the predecessors or the successors of each state
+    depends on how they were built.
+    """
+
+    def __init__(self, num_states, indptr, indices, log_probabilities):
+        self.num_states = num_states
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.log_probabilities = np.asarray(log_probabilities, dtype=np.float64)
+
+        # Used to reduce over each list at once, which only works on lists
+        # that aren't empty.
+        counts = np.diff(self.indptr)
+        self.nonempty = counts > 0
+        self.starts = self.indptr[:-1][self.nonempty]
+        self.counts = counts[self.nonempty]
+
+    @property
+    def nnz(self):
+        return self.indices.shape[0]
+
+    @classmethod
+    def from_pairs(cls, num_states, owners, others, log_probabilities):
+        """
+        Build the lists from (owner, other, log-probability) triples, given as
+        three sequences, adding each `other` to the list of its `owner`.
+        """
+
+        owners = np.asarray(owners, dtype=np.int64)
+        others = np.asarray(others, dtype=np.int64)
+        log_probabilities = np.asarray(log_probabilities, dtype=np.float64)
+
+        order = np.lexsort((others, owners))
+        counts = np.bincount(owners, minlength=num_states)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+
+        return cls(
+            num_states,
+            indptr,
+            others[order],
+            log_probabilities[order]
+        )
+
+    @classmethod
+    def from_dense(cls, log_matrix):
+        """
+        Build the lists from an S×S array of log-probabilities, where each row
+        holds those of one state's transitions. Transitions with a probability
+        of 0 are left out.
+        """
+
+        owners, others = np.nonzero(np.isfinite(log_matrix))
+        return cls.from_pairs(
+            log_matrix.shape[0],
+            owners,
+            others,
+            log_matrix[owners, others]
+        )
+
+    def owners(self):
+        """
+        The state owning each transition, in the same order as `indices`.
+        """
+
+        return np.repeat(
+            np.arange(self.num_states, dtype=np.int32),
+            np.diff(self.indptr)
+        )
+
+    def transposed(self):
+        """
+        The same transitions, listed for the state on the other side. This
+        turns lists of predecessors into lists of successors and back.
+        """
+
+        return TransitionLists.from_pairs(
+            self.num_states,
+            self.indices,
+            self.owners(),
+            self.log_probabilities
+        )
+
+
+class CompiledHMM:
+    """
+    A Hidden Markov Model in array form, as created by `HMM.compile`:
+
+      - `states` and `observations` list the states and the observations, so
+        that each one is identified by its position in the list.
+      - `log_p` holds the logarithm of the initial probability of each state.
+      - `log_a[r, s]` holds the logarithm of the probability of going from
+        state r to state s. For sparse models, this is `None`, and only the
+        lists of nonzero transitions are stored.
+      - `log_b[s, o]` holds the logarithm of the probability of state s
+        producing observation o.
+
+    Probabilities of 0 are stored as minus infinity. Working with logarithms
+    means probabilities are added instead of multiplied, so the probabilities
+    of long paths don't round down to 0.
+
+    The nonzero transitions into and out of each state are available as
+    `predecessors` and `successors` (see `TransitionLists`), which are built
+    from `log_a` the first time they're used, unless they were given.
+    """
+
+    def __init__(
+        self,
+        states,
+        observations,
+        log_p,
+        log_a,
+        log_b,
+        predecessors=None
+    ):
+        if log_a is None and predecessors is None:
+            raise ValueError('Either log_a or predecessors must be given')
+
+        self.states = list(states)
+        self.observations = list(observations)
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.observation_index = {
+            observation: i for i, observation in enumerate(self.observations)
+        }
+
+        self.log_p = log_p
+        self.log_a = log_a
+        self.log_b = log_b
+
+        self._predecessors = predecessors
+        self._successors = None
+
+    @property
+    def num_states(self):
+        return len(self.states)
+
+    @property
+    def predecessors(self):
+        if self._predecessors is None:
+            self._predecessors = TransitionLists.from_dense(self.log_a.T)
+        return self._predecessors
+
+    @property
+    def successors(self):
+        if self._successors is None:
+            self._successors = self.predecessors.transposed()
+        return self._successors
+
+    @property
+    def density(self):
+        """
+        The fraction of all possible transitions that are nonzero.
+        """
+
+        if self.log_a is not None and self._predecessors is None:
+            return np.count_nonzero(np.isfinite(self.log_a)) / self.log_a.size
+        return self.predecessors.nnz / max(self.num_states ** 2, 1)
+
+    @property
+    def is_sparse(self):
+        """
+        Whether the model should be decoded with the sparse engine: either
+        there's no dense transition matrix, or it's mostly zeros.
+        """
+
+        return self.log_a is None or self.density <= SPARSE_DENSITY
+
+    def encode(self, observations):
+        """
+        Convert a sequence of observations into an array of their numbers.
+        """
+
+        try:
+            return np.array(
+                [self.observation_index[o] for o in observations],
+                dtype=np.int32
+            )
+        except KeyError as e:
+            raise ValueError(f'Unknown observation: {e.args[0]}')
+
+    def decode(self, state_indices):
+        """
+        Convert a sequence of state numbers back into the states themselves.
+        """
+
+        return [self.states[i] for i in state_indices]
+
+    def to_hmm(self):
+        """
+        Convert the model back into an `HMM`, with its probabilities in
+        dictionaries. Dense models list every transition, while sparse models
+        only list the nonzero ones, so that large models stay small. Missing
+        transitions have a probability of 0, for `viterbi` as for `compile`.
+        """
+
+        p = np.exp(self.log_p)
+        b = np.exp(self.log_b)
+
+        if self.log_a is not None:
+            a = np.exp(self.log_a)
+            transitions = {
+                r: {s: float(a[i, j]) for j, s in enumerate(self.states)}
+                for i, r in enumerate(self.states)
+            }
+        else:
+            successors = self.successors
+            transitions = {}
+            for i, r in enumerate(self.states):
+                start, end = successors.indptr[i], successors.indptr[i + 1]
+                transitions[r] = {
+                    self.states[j]: float(probability)
+                    for j, probability in zip(
+                        successors.indices[start:end].tolist(),
+                        np.exp(successors.log_probabilities[start:end])
+                    )
+                }
+
+        return HMM(
+            {s: float(p[i]) for i, s in enumerate(self.states)},
+            transitions,
+            {
+                s: {
+                    observation: float(b[i, k])
+                    for k, observation in enumerate(self.observations)
+                }
+                for i, s in enumerate(self.states)
+            }
+        )
+
+
+def compile_hmm(hmm):
+    """
+    Compile an `HMM`, or return it as it is if it's already compiled.
+    """
+
+    if isinstance(hmm, CompiledHMM):
+        return hmm
+    return hmm.compile()
+
+
+def log_probabilities(probabilities):
+    """
+    The logarithms of an array of probabilities, with minus infinity for the
+    probabilities of 0.
+    """
+
+    with np.errstate(divide='ignore'):
+        return np.log(probabilities)
+
 
 SPEECH_RECOGNITION_HMM = HMM(
     # Initial state probabilities. We can start with 'au' or 'o' with equal
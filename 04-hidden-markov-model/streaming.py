@@ -0,0 +1,232 @@
+"""
+Decoding a stream of observations as it arrives, without waiting for it to end
+and without keeping the back pointers of the whole stream.
+
+The Viterbi algorithm can't know the state at a given time until it has seen
+every observation. But often, all the paths still worth following agree on
+their start: following the back pointers from every state that still has a
+nonzero path probability leads to the same state at some earlier time. Every
+state up to that point is then decided for good, since the best path at the
+end of the stream will be one of those paths.
+
+If the paths take too long to agree, the oldest state is decided anyway,
+following the back pointers from the best path so far. That's the fixed lag:
+no state is decided more than `max_lag` observations late, and only that many
+rows of back pointers are ever kept.
+
+The lag should be longer than it usually takes the paths to agree, or most
+states end up forced, and those can differ from the states `viterbi` would
+find. This file can be run directly to decode a long generated stream and
+compare the result against decoding it all at once, separately for the states
+decided when the paths agreed and for the forced ones:
+
+    python3 streaming.py 100000 100
+
+On the generated model used there, the paths usually agree within about 35
+observations, so a lag of 20 forces most decisions, and a lag of 100 almost
+none.
+"""
+
+import sys
+
+import numpy as np
+
+from model import compile_hmm
+from synthetic import random_sparse_hmm
+from viterbi import choose_engine, viterbi_indices, viterbi_step
+
+
+class StreamingViterbi:
+    """
+    Decodes observations one at a time, with a Hidden Markov Model that's
+    either an `HMM` or a `CompiledHMM`.
+
+    Each call to `push` returns the states decided thanks to that observation,
+    possibly none, in order. Once the stream is over, `flush` returns the rest.
+    As long as some path has a nonzero probability, the states decided when
+    the paths agree are the same as those `viterbi` would find on the whole
+    stream. `forced_decisions` counts the states that were decided by the
+    fixed lag instead, which may not be.
+    """
+
+    def __init__(self, hmm, max_lag=100, engine='auto'):
+        if max_lag < 1:
+            raise ValueError('The lag must be at least 1')
+
+        self.compiled = compile_hmm(hmm)
+        self.max_lag = max_lag
+        self.engine = choose_engine(self.compiled, engine)
+
+        self.num_observations = 0
+        self.num_decided = 0
+        self.forced_decisions = 0
+
+        self._scores = None
+
+        # The back pointers of time t are stored in row t % max_lag, and only
+        # those after the last decided time are kept.
+        self._back_pointers = np.empty(
+            (max_lag, self.compiled.num_states),
+            dtype=np.int32
+        )
+
+    def push(self, observation):
+        """
+        Add the next observation, returning the list of newly decided states.
+        """
+
+        compiled = self.compiled
+        o = compiled.observation_index.get(observation)
+        if o is None:
+            raise ValueError(f'Unknown observation: {observation}')
+
+        t = self.num_observations
+
+        if t == 0:
+            decided = []
+            self._scores = compiled.log_p + compiled.log_b[:, o]
+        else:
+            # Room for this row is made before it overwrites the oldest one.
+            decided = self._force_decisions(t - self.max_lag)
+            scores, back_pointers = \
+                viterbi_step(compiled, self._scores, self.engine)
+            self._scores = scores + compiled.log_b[:, o]
+            self._back_pointers[t % self.max_lag] = back_pointers
+
+        self.num_observations += 1
+
+        return compiled.decode(decided + self._decide_converged())
+
+    def flush(self):
+        """
+        Decide all the remaining states, following the back pointers from the
+        most probable state after the last observation.
+        """
+
+        if self.num_decided == self.num_observations:
+            return []
+
+        now = self.num_observations - 1
+        path = self._backtrack(now, int(self._scores.argmax()))
+        return self.compiled.decode(path)
+
+    def _decide_converged(self):
+        # Follow the back pointers from every state whose path still has a
+        # nonzero probability, keeping only the distinct states the surviving
+        # paths go through, until they all go through the same one.
+        now = self.num_observations - 1
+
+        states = np.flatnonzero(self._scores > -np.inf)
+        if states.size == 0:
+            return []
+
+        for t in range(now, self.num_decided - 1, -1):
+            if states.size == 1:
+                return self._backtrack(t, int(states[0]))
+            if t > self.num_decided:
+                back_pointers = self._back_pointers[t % self.max_lag]
+                states = np.unique(back_pointers[states])
+
+        return []
+
+    def _force_decisions(self, until):
+        # Decide every state up to and including time `until`, following the
+        # back pointers from the most probable state so far.
+        if until < self.num_decided:
+            return []
+
+        now = self.num_observations - 1
+        state = int(self._scores.argmax())
+        for t in range(now, until, -1):
+            state = self._back_pointers[t % self.max_lag][state]
+
+        decided = self._backtrack(until, int(state))
+        self.forced_decisions += len(decided)
+        return decided
+
+    def _backtrack(self, t, state):
+        # Decide every state up to and including time t, given the state at
+        # time t.
+        path = [state]
+        for u in range(t, self.num_decided, -1):
+            state = int(self._back_pointers[u % self.max_lag][state])
+            path.append(state)
+
+        path.reverse()
+        self.num_decided = t + 1
+        return path
+
+
+def decode_stream(hmm, observations, max_lag=100, engine='auto'):
+    """
+    Decode an iterable of observations, such as a generator, yielding each
+    state as soon as it's decided. See `StreamingViterbi`.
+    """
+
+    decoder = StreamingViterbi(hmm, max_lag, engine)
+    for observation in observations:
+        yield from decoder.push(observation)
+    yield from decoder.flush()
+
+
+async def decode_stream_async(hmm, observations, max_lag=100, engine='auto'):
+    """
+    Decode an asynchronous iterable of observations, yielding each state as
+    soon as it's decided. See `StreamingViterbi`.
+    """
+
+    decoder = StreamingViterbi(hmm, max_lag, engine)
+    async for observation in observations:
+        for state in decoder.push(observation):
+            yield state
+    for state in decoder.flush():
+        yield state
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f'USAGE: {__file__} <num-observations> <max-lag>')
+        sys.exit(1)
+
+    num_observations = int(sys.argv[1])
+    max_lag = int(sys.argv[2])
+
+    compiled = random_sparse_hmm(200, 30)
+    rng = np.random.default_rng(1)
+    observations = rng.integers(0, 30, num_observations)
+
+    decoder = StreamingViterbi(compiled, max_lag)
+
+    delays = []
+    streamed_path = []
+    # Whether each state was forced. The forced states of a push come before
+    # those decided when the paths agreed, and the states decided by `flush`
+    # are never forced.
+    forced = []
+    for t, observation in enumerate(observations):
+        forced_before = decoder.forced_decisions
+        decided = decoder.push(observation)
+        delays.extend(t - time for time in range(
+            len(streamed_path),
+            len(streamed_path) + len(decided)
+        ))
+        streamed_path.extend(decided)
+
+        num_forced = decoder.forced_decisions - forced_before
+        forced.extend([True] * num_forced)
+        forced.extend([False] * (len(decided) - num_forced))
+
+    flushed = decoder.flush()
+    streamed_path.extend(flushed)
+    forced.extend([False] * len(flushed))
+
+    expected_path, _ = viterbi_indices(compiled, observations)
+    differs = np.array(streamed_path) != expected_path
+    forced = np.array(forced)
+
+    print(f'Observations:       {num_observations}')
+    print(f'Average delay:      {np.mean(delays):.1f} observations')
+    print(f'Not forced:         {np.count_nonzero(~forced)} decisions, '
+          f'{np.count_nonzero(differs & ~forced)} different')
+    print(f'Forced:             {decoder.forced_decisions} decisions, '
+          f'{np.count_nonzero(differs & forced)} different')
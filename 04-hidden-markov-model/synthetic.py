@@ -0,0 +1,79 @@
+"""
+Randomly generated models and observations, for trying out and comparing the
+decoding and training algorithms on models much larger than
+`SPEECH_RECOGNITION_HMM`.
+"""
+
+import numpy as np
+
+from model import CompiledHMM, TransitionLists
+
+
+def random_sparse_hmm(num_states, num_observations, successors=3, seed=0):
+    """
+    Generate a random `CompiledHMM` where each state can only move on to a few
+    other states, and mostly produces a few of the observations, for testing
+    on long streams.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    owners = np.repeat(np.arange(num_states), successors)
+    others = np.concatenate([
+        rng.choice(num_states, successors, replace=False)
+        for _ in range(num_states)
+    ])
+    probabilities = rng.dirichlet(np.ones(successors), num_states).ravel()
+
+    with np.errstate(divide='ignore'):
+        transitions = TransitionLists.from_pairs(
+            num_states,
+            owners,
+            others,
+            np.log(probabilities)
+        )
+        log_b = np.log(
+            rng.dirichlet(np.full(num_observations, 0.1), num_states)
+        )
+
+    return CompiledHMM(
+        range(num_states),
+        range(num_observations),
+        np.full(num_states, -np.log(num_states)),
+        None,
+        log_b,
+        transitions.transposed()
+    )
+
+
+def sample_observations(compiled, length, seed=0):
+    """
+    Generate a sequence of `length` observation numbers from a `CompiledHMM`,
+    by walking through its states at random. Returns a tuple with the
+    observations and the states they came from.
+    """
+
+    rng = np.random.default_rng(seed)
+    successors = compiled.successors
+
+    states = np.empty(length, dtype=np.int32)
+    observations = np.empty(length, dtype=np.int32)
+
+    state = rng.choice(compiled.num_states, p=np.exp(compiled.log_p))
+    for t in range(length):
+        if t > 0:
+            start, end = successors.indptr[state], successors.indptr[state + 1]
+            probabilities = np.exp(successors.log_probabilities[start:end])
+            state = rng.choice(
+                successors.indices[start:end],
+                p=probabilities / probabilities.sum()
+            )
+
+        emissions = np.exp(compiled.log_b[state])
+        states[t] = state
+        observations[t] = rng.choice(
+            emissions.shape[0],
+            p=emissions / emissions.sum()
+        )
+
+    return (observations, states)
@@ -0,0 +1,613 @@
+"""
+Estimating the probabilities of a Hidden Markov Model from sequences of
+observations alone, without knowing which states produced them, using the
+Baum-Welch algorithm.
+
+Starting from a guess, each iteration has two steps:
+
+  - The E-step runs the forward-backward algorithm on every sequence, to find
+    how likely each state and each transition is at each time step, given the
+    observations. Adding those up over all the sequences gives the expected
+    number of times each state starts a sequence, each transition is taken
+    and each observation is produced by each state.
+  - The M-step turns those expected counts back into probabilities.
+
+Each iteration makes the sequences at least as likely as the previous one, and
+training stops once the improvement gets small enough.
+
+The forward and backward passes work on probabilities rather than logarithms,
+but rescale each time step to add up to 1, so long sequences don't round down
+to 0. The logarithm of the probability of the sequence is the sum of the
+logarithms of the scaling factors. Each time step is a single product with the
+transition matrix, or with the lists of nonzero transitions for sparse models
+(see `TransitionLists`).
+
+Transitions and emissions with a probability of 0 are never expected to happen,
+so they stay at 0: the structure of the initial guess is kept throughout
+training, and sparse models stay sparse.
+
+The E-step can run on several processes, each one handling shards of the
+sequences, which are sent to the processes once, when training starts. The
+model can be saved after each iteration, so that training can be picked up
+again later.
+
+This file can be run directly to train a model on sequences generated by
+another model with the same structure:
+
+    python3 training.py 500
+"""
+
+import contextlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model import (
+    CompiledHMM,
+    TransitionLists,
+    compile_hmm,
+    log_probabilities,
+)
+from synthetic import random_sparse_hmm, sample_observations
+
+
+# The sparse E-step gathers this many (time step, transition) pairs at a time,
+# to bound the memory it uses.
+SPARSE_BLOCK_SIZE = 1 << 20
+
+
+class ExpectedCounts:
+    """
+    The expected number of times each part of a model is used, added up over
+    some sequences of observations:
+
+      - `initial[s]` for state s starting a sequence.
+      - `transitions` for each transition being taken, as an S×S array for
+        dense models, and in the same order as the lists of `predecessors`
+        for sparse ones.
+      - `emissions[s, o]` for state s producing observation o.
+
+    Along with the total log-probability of the sequences, and how many there
+    were. Sequences that the model can't produce at all are left out, and only
+    counted in `num_impossible`.
+    """
+
+    def __init__(
+        self,
+        initial,
+        transitions,
+        emissions,
+        log_likelihood=0.0,
+        num_sequences=0,
+        num_impossible=0
+    ):
+        self.initial = initial
+        self.transitions = transitions
+        self.emissions = emissions
+        self.log_likelihood = log_likelihood
+        self.num_sequences = num_sequences
+        self.num_impossible = num_impossible
+
+    @classmethod
+    def zeros(cls, compiled):
+        """
+        Counts of 0 for every part of a `CompiledHMM`.
+        """
+
+        if compiled.log_a is not None:
+            transitions = np.zeros_like(compiled.log_a)
+        else:
+            transitions = np.zeros(compiled.predecessors.nnz)
+
+        return cls(
+            np.zeros_like(compiled.log_p),
+            transitions,
+            np.zeros_like(compiled.log_b)
+        )
+
+    def add(self, other):
+        """
+        Add another set of counts for the same model to these ones.
+        """
+
+        self.initial += other.initial
+        self.transitions += other.transitions
+        self.emissions += other.emissions
+        self.log_likelihood += other.log_likelihood
+        self.num_sequences += other.num_sequences
+        self.num_impossible += other.num_impossible
+
+
+class _Probabilities:
+    # The probabilities of a `CompiledHMM`, out of log space, as the forward
+    # and backward passes use them.
+
+    def __init__(self, compiled):
+        self.num_states = compiled.num_states
+        self.p = np.exp(compiled.log_p)
+        self.b = np.exp(compiled.log_b)
+
+        if compiled.log_a is not None:
+            self.a = np.exp(compiled.log_a)
+        else:
+            self.a = None
+            self.predecessors = compiled.predecessors
+            self.successors = compiled.successors
+            self.predecessor_probabilities = \
+                np.exp(self.predecessors.log_probabilities)
+            self.successor_probabilities = \
+                np.exp(self.successors.log_probabilities)
+            self.sources = self.predecessors.indices
+            self.targets = self.predecessors.owners()
+
+    def forward(self, alpha):
+        # The probability of reaching each state, given the probability of
+        # being at each state one time step before.
+        if self.a is not None:
+            return alpha @ self.a
+        return self._sum_lists(
+            alpha,
+            self.predecessors,
+            self.predecessor_probabilities
+        )
+
+    def backward(self, beta):
+        # The sum over the successors of each state, of the transition
+        # probability times the successor's value in `beta`.
+        if self.a is not None:
+            return self.a @ beta
+        return self._sum_lists(
+            beta,
+            self.successors,
+            self.successor_probabilities
+        )
+
+    def _sum_lists(self, values, lists, probabilities):
+        result = np.zeros(self.num_states)
+        if lists.nnz > 0:
+            result[lists.nonempty] = np.add.reduceat(
+                values[lists.indices] * probabilities,
+                lists.starts
+            )
+        return result
+
+
+def forward_backward(hmm, observations):
+    """
+    The scaled forward-backward algorithm, on a Hidden Markov Model that's
+    either an `HMM` or a `CompiledHMM`, given the observations as an array of
+    their numbers (see `CompiledHMM.encode`).
+
+    Returns a tuple with three arrays, or `None` if the model can't produce
+    the observations at all:
+
+      1. The T×S forward probabilities: at each time step, the probability of
+         each state given the observations so far, so each row adds up to 1.
+      2. The T×S backward probabilities, scaled by the same factors as the
+         forward ones, so that the product of both gives the probability of
+         each state given all the observations.
+      3. The scaling factor of each time step. The sum of their logarithms is
+         the log-probability of the observations.
+    """
+
+    return _forward_backward(
+        _Probabilities(compile_hmm(hmm)),
+        observations
+    )
+
+
+def _forward_backward(model, observations):
+    num_steps = len(observations)
+    emissions = model.b.T
+
+    alpha = np.empty((num_steps, model.num_states))
+    beta = np.empty((num_steps, model.num_states))
+    scales = np.empty(num_steps)
+
+    for t in range(num_steps):
+        if t == 0:
+            row = model.p * emissions[observations[0]]
+        else:
+            row = model.forward(alpha[t - 1]) * emissions[observations[t]]
+
+        scales[t] = row.sum()
+        if scales[t] == 0:
+            return None
+        alpha[t] = row / scales[t]
+
+    beta[num_steps - 1] = 1
+    for t in range(num_steps - 2, -1, -1):
+        beta[t] = model.backward(
+            emissions[observations[t + 1]] * beta[t + 1]
+        ) / scales[t + 1]
+
+    return (alpha, beta, scales)
+
+
+def expected_counts(hmm, observations):
+    """
+    The expected counts (see `ExpectedCounts`) for a single sequence, given
+    as an array of observation numbers.
+    """
+
+    compiled = compile_hmm(hmm)
+    counts = ExpectedCounts.zeros(compiled)
+    _add_expected_counts(counts, _Probabilities(compiled), observations)
+    return counts
+
+
+def _add_expected_counts(counts, model, observations):
+    counts.num_sequences += 1
+    if len(observations) == 0:
+        return
+
+    result = _forward_backward(model, observations)
+    if result is None:
+        counts.num_impossible += 1
+        return
+
+    alpha, beta, scales = result
+
+    # The probability of each state at each time step.
+    gamma = alpha * beta
+
+    counts.log_likelihood += np.log(scales).sum()
+    counts.initial += gamma[0]
+    np.add.at(counts.emissions.T, observations, gamma)
+
+    # The probability of the transition from r at time t to s at time t + 1
+    # is alpha[t, r] a[r, s] weights[t, s].
+    weights = model.b.T[observations[1:]] * beta[1:] / scales[1:, np.newaxis]
+
+    if model.a is not None:
+        counts.transitions += model.a * (alpha[:-1].T @ weights)
+        return
+
+    alpha = alpha[:-1]
+    nnz = model.predecessors.nnz
+    block_size = max(SPARSE_BLOCK_SIZE // max(nnz, 1), 1)
+    for start in range(0, len(observations) - 1, block_size):
+        end = start + block_size
+        counts.transitions += model.predecessor_probabilities * (
+            alpha[start:end][:, model.sources]
+            * weights[start:end][:, model.targets]
+        ).sum(axis=0)
+
+
+def e_step(hmm, sequences):
+    """
+    Add up the expected counts (see `ExpectedCounts`) of a list of sequences,
+    each given as an array of observation numbers.
+    """
+
+    compiled = compile_hmm(hmm)
+    model = _Probabilities(compiled)
+
+    counts = ExpectedCounts.zeros(compiled)
+    for observations in sequences:
+        _add_expected_counts(counts, model, observations)
+
+    return counts
+
+
+def m_step(compiled, counts):
+    """
+    Turn expected counts into a new `CompiledHMM`, with the same states,
+    observations and nonzero transitions as the given one. States that were
+    never expected to be used keep their previous probabilities.
+    """
+
+    log_p = compiled.log_p
+    if counts.initial.sum() > 0:
+        log_p = log_probabilities(counts.initial / counts.initial.sum())
+
+    log_b = _normalize_rows(counts.emissions, compiled.log_b)
+
+    if compiled.log_a is not None:
+        log_a = _normalize_rows(counts.transitions, compiled.log_a)
+        return CompiledHMM(
+            compiled.states,
+            compiled.observations,
+            log_p,
+            log_a,
+            log_b
+        )
+
+    # Each transition's count is divided by the total of the transitions
+    # leaving the same state.
+    predecessors = compiled.predecessors
+    sources = predecessors.indices
+    totals = np.bincount(
+        sources,
+        weights=counts.transitions,
+        minlength=compiled.num_states
+    )
+
+    log_transitions = predecessors.log_probabilities.copy()
+    used = totals[sources] > 0
+    log_transitions[used] = log_probabilities(
+        counts.transitions[used] / totals[sources][used]
+    )
+
+    return CompiledHMM(
+        compiled.states,
+        compiled.observations,
+        log_p,
+        None,
+        log_b,
+        TransitionLists(
+            compiled.num_states,
+            predecessors.indptr,
+            predecessors.indices,
+            log_transitions
+        )
+    )
+
+
+def _normalize_rows(counts, previous_log_probabilities):
+    # Each row of counts divided by its total, as logarithms, keeping the
+    # previous row where the total is 0.
+    totals = counts.sum(axis=1)
+    used = totals > 0
+
+    result = previous_log_probabilities.copy()
+    result[used] = log_probabilities(counts[used] / totals[used, np.newaxis])
+    return result
+
+
+def baum_welch(
+    hmm,
+    sequences,
+    max_iterations=100,
+    tolerance=1e-6,
+    workers=None,
+    shard_size=256,
+    checkpoint=None,
+    history=None,
+    verbose=True
+):
+    """
+    Train a Hidden Markov Model, either an `HMM` or a `CompiledHMM`, on a list
+    of sequences of observations, with the Baum-Welch algorithm. The model
+    given is the starting point, and its zero probabilities stay at 0.
+
+    Training stops after `max_iterations`, or once an iteration improves the
+    log-probability of the sequences by less than `tolerance` per observation.
+
+      - If `workers` is given, the E-step runs on a pool of that many
+        processes, with the sequences split into shards of `shard_size`.
+      - If `checkpoint` is given, the model and the history are saved to that
+        file after each iteration (see `save_checkpoint`).
+      - Training can be picked up again by passing the model and `history`
+        from `load_checkpoint`.
+
+    Returns a tuple with two values: the trained `CompiledHMM`, and the
+    history of the log-probability of the sequences before each iteration.
+    """
+
+    compiled = compile_hmm(hmm)
+    history = list(history or [])
+
+    encoded = [compiled.encode(sequence) for sequence in sequences]
+    num_observations = max(sum(len(sequence) for sequence in encoded), 1)
+    shards = [
+        encoded[i:i + shard_size]
+        for i in range(0, len(encoded), shard_size)
+    ]
+
+    if workers is None:
+        pool = contextlib.nullcontext()
+    else:
+        pool = ProcessPoolExecutor(
+            workers,
+            initializer=_set_worker_shards,
+            initargs=(shards,)
+        )
+
+    with pool as executor:
+        for _ in range(max_iterations):
+            start = time.perf_counter()
+
+            if executor is None:
+                parts = [e_step(compiled, shard) for shard in shards]
+            else:
+                parts = executor.map(
+                    _shard_counts,
+                    [compiled] * len(shards),
+                    range(len(shards))
+                )
+
+            counts = ExpectedCounts.zeros(compiled)
+            for part in parts:
+                counts.add(part)
+
+            if counts.num_impossible == counts.num_sequences:
+                raise ValueError(
+                    'The model can\'t produce any of the sequences'
+                )
+
+            compiled = m_step(compiled, counts)
+
+            improvement = None
+            if history:
+                improvement = \
+                    (counts.log_likelihood - history[-1]) / num_observations
+            history.append(counts.log_likelihood)
+
+            if checkpoint is not None:
+                save_checkpoint(checkpoint, compiled, history)
+
+            if verbose:
+                print(
+                    f'Iteration {len(history)}: '
+                    f'log-likelihood {counts.log_likelihood:.4f}, '
+                    f'{counts.num_impossible} impossible sequences '
+                    f'({time.perf_counter() - start:.2f}s)'
+                )
+
+            if improvement is not None and improvement < tolerance:
+                break
+
+    return (compiled, history)
+
+
+# The shards of sequences handled by each worker process, set once when the
+# process starts.
+_worker_shards = None
+
+
+def _set_worker_shards(shards):
+    global _worker_shards
+    _worker_shards = shards
+
+
+def _shard_counts(compiled, shard_index):
+    return e_step(compiled, _worker_shards[shard_index])
+
+
+def save_checkpoint(filename, compiled, history=()):
+    """
+    Save a `CompiledHMM` and its training history to an `.npz` file. The
+    states and observations must all be strings, or all be numbers.
+    """
+
+    arrays = {
+        'states': np.array(compiled.states),
+        'observations': np.array(compiled.observations),
+        'log_p': compiled.log_p,
+        'log_b': compiled.log_b,
+        'history': np.array(history, dtype=np.float64),
+    }
+
+    if compiled.log_a is not None:
+        arrays['log_a'] = compiled.log_a
+    else:
+        predecessors = compiled.predecessors
+        arrays['indptr'] = predecessors.indptr
+        arrays['indices'] = predecessors.indices
+        arrays['log_probabilities'] = predecessors.log_probabilities
+
+    np.savez(filename, **arrays)
+
+
+def load_checkpoint(filename):
+    """
+    Load a model saved by `save_checkpoint`. Returns a tuple with the
+    `CompiledHMM` and its training history.
+    """
+
+    with np.load(filename) as data:
+        states = data['states'].tolist()
+        predecessors = None
+        log_a = None
+
+        if 'log_a' in data:
+            log_a = data['log_a']
+        else:
+            predecessors = TransitionLists(
+                len(states),
+                data['indptr'],
+                data['indices'],
+                data['log_probabilities']
+            )
+
+        compiled = CompiledHMM(
+            states,
+            data['observations'].tolist(),
+            data['log_p'],
+            log_a,
+            data['log_b'],
+            predecessors
+        )
+
+        return (compiled, data['history'].tolist())
+
+
+def initial_guess(compiled, seed=0):
+    """
+    A starting point for training: the same model, with the same zero
+    probabilities, but with the nonzero probabilities of each state replaced
+    by random ones.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    p = _randomize(rng, compiled.log_p)
+    b = _randomize(rng, compiled.log_b)
+    b /= np.maximum(b.sum(axis=1, keepdims=True), np.finfo(float).tiny)
+
+    if compiled.log_a is not None:
+        a = _randomize(rng, compiled.log_a)
+        a /= np.maximum(a.sum(axis=1, keepdims=True), np.finfo(float).tiny)
+        log_a = log_probabilities(a)
+        predecessors = None
+    else:
+        log_a = None
+        predecessors = compiled.predecessors
+
+        # Each transition is divided by the total of the transitions leaving
+        # the same state.
+        a = _randomize(rng, predecessors.log_probabilities)
+        totals = np.bincount(
+            predecessors.indices,
+            weights=a,
+            minlength=compiled.num_states
+        )
+        predecessors = TransitionLists(
+            compiled.num_states,
+            predecessors.indptr,
+            predecessors.indices,
+            log_probabilities(a / totals[predecessors.indices])
+        )
+
+    return CompiledHMM(
+        compiled.states,
+        compiled.observations,
+        log_probabilities(p / p.sum()),
+        log_a,
+        log_probabilities(b),
+        predecessors
+    )
+
+
+def _randomize(rng, template):
+    # Random weights in the same shape, left at 0 where the probabilities are.
+    return np.where(
+        np.isfinite(template),
+        rng.random(template.shape) + 0.5,
+        0
+    )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(f'USAGE: {__file__} <num-sequences> [<workers>]')
+        sys.exit(1)
+
+    num_sequences = int(sys.argv[1])
+    workers = int(sys.argv[2]) if len(sys.argv) == 3 else None
+
+    true_model = random_sparse_hmm(20, 10, successors=3)
+    sequences = [
+        sample_observations(true_model, 50, seed=i)[0].tolist()
+        for i in range(num_sequences)
+    ]
+
+    true_log_likelihood = e_step(
+        true_model,
+        [np.array(sequence) for sequence in sequences]
+    ).log_likelihood
+    print(f'Log-likelihood of the true model: {true_log_likelihood:.4f}')
+
+    trained, history = baum_welch(
+        initial_guess(true_model),
+        sequences,
+        max_iterations=50,
+        workers=workers
+    )
+
+    hmm = trained.to_hmm()
+    print(f'Trained {len(hmm.possible_states)} states in '
+          f'{len(history)} iterations')
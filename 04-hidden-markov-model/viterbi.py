@@ -6,10 +6,21 @@ the `model_04_02.py` file is used as the basis of the algorithm.
 This file can be run directly to compare the greedy and Viterbi algorithms:
 
     python3 viterbi.py
+
+A vectorized version of the Viterbi algorithm, working on a compiled model (see
+`HMM.compile`), is also available as `viterbi_log_space`. For models where most
+transitions have a probability of 0, it only visits the nonzero ones.
 """
 
+import numpy as np
+
+from model import SPEECH_RECOGNITION_HMM, compile_hmm
 
-from model import SPEECH_RECOGNITION_HMM
+
+# The most memory the 'dense' engine of `viterbi_step` uses for the scores of
+# the candidate transitions at once, in bytes. Larger batches and models are
+# handled a block of previous states at a time.
+DENSE_STEP_MAX_BYTES = 64 * 1024 ** 2
 
 
 def greedy(hmm, observations):
@@ -66,7 +77,7 @@ def viterbi(hmm, observations):
         for s in hmm.possible_states:
             possible_transition_probabilities = [
                 (
-                    v_grid[t - 1][r].probability * hmm.a[r][s],
+                    v_grid[t - 1][r].probability * hmm.a[r].get(s, 0),
                     r
                 )
                 for r in hmm.possible_states
@@ -98,6 +109,172 @@ def viterbi(hmm, observations):
     return path_states
 
 
+def viterbi_log_space(hmm, observations):
+    """
+    Given a Hidden Markov Model, either an `HMM` or a `CompiledHMM`, and a
+    sequence of observations, finds the most probable sequence of states that
+    produced the observations.
+
+    This returns the same path as `viterbi`, but works on the logarithms of the
+    probabilities, so long sequences don't make every path probability round
+    down to 0. Ties are broken the same way, in favor of the earliest state,
+    although paths with exactly the same probability may compare differently
+    once rounded as logarithms.
+    """
+
+    compiled = compile_hmm(hmm)
+    path, _ = viterbi_indices(compiled, compiled.encode(observations))
+    return compiled.decode(path)
+
+
+def viterbi_indices(compiled, observations, engine='auto'):
+    """
+    The Viterbi algorithm on a `CompiledHMM`, given the observations as an
+    array of their numbers (see `CompiledHMM.encode`).
+
+    Each time step is a single max-plus operation (see `viterbi_step`), with
+    the best previous state for each state kept as a 32-bit back pointer.
+
+    Returns a tuple with two values:
+
+      1. The array of state numbers on the most probable path.
+      2. The log-probability of that path.
+    """
+
+    engine = choose_engine(compiled, engine)
+
+    num_steps = len(observations)
+    if num_steps == 0:
+        return (np.empty(0, dtype=np.int32), 0.0)
+
+    back_pointers = np.empty((num_steps, compiled.num_states), dtype=np.int32)
+    back_pointers[0] = 0
+
+    scores = compiled.log_p + compiled.log_b[:, observations[0]]
+
+    for t in range(1, num_steps):
+        scores, back_pointers[t] = viterbi_step(compiled, scores, engine)
+        scores += compiled.log_b[:, observations[t]]
+
+    end_state = int(scores.argmax())
+    return (backtrack_path(back_pointers, end_state), scores[end_state].item())
+
+
+def choose_engine(compiled, engine='auto'):
+    """
+    Resolve the engine used for the transitions of a `CompiledHMM`: 'dense'
+    scores every pair of states, while 'sparse' only visits the nonzero
+    transitions. 'auto' picks 'sparse' for models that are mostly zeros (see
+    `CompiledHMM.is_sparse`).
+    """
+
+    if engine == 'auto':
+        return 'sparse' if compiled.is_sparse else 'dense'
+    if engine == 'dense' and compiled.log_a is None:
+        raise ValueError('The dense engine needs a dense transition matrix')
+    if engine not in ('dense', 'sparse'):
+        raise ValueError(f'Unknown Viterbi engine: {engine}')
+    return engine
+
+
+def viterbi_step(compiled, scores, engine='dense'):
+    """
+    One max-plus step of the Viterbi algorithm. Given the log-probabilities of
+    the best paths ending at each state, as an array whose last axis has one
+    entry per state, returns a tuple with two arrays of the same shape:
+
+      1. The log-probability of the best path into each state, before the
+         emission probabilities are added.
+      2. The state each of those paths comes from, as 32-bit integers.
+
+    Ties go to the earliest previous state, as in `viterbi`. The 'sparse'
+    engine only visits the nonzero transitions, and gives the same results as
+    the 'dense' one: states that can't be reached at all get a back pointer of
+    0, the first of the equally impossible previous states.
+
+    The 'dense' engine scores every transition, and would need a B×S×S array
+    of candidates for a batch of B rows of scores. It goes through the
+    previous states in blocks instead, so that the candidates of a block take
+    at most `DENSE_STEP_MAX_BYTES`.
+    """
+
+    if engine == 'dense':
+        log_a = compiled.log_a
+        num_states = log_a.shape[0]
+
+        batch_size = scores.size // max(num_states, 1)
+        block_size = DENSE_STEP_MAX_BYTES // \
+            max(batch_size * num_states * log_a.itemsize, 1)
+        block_size = min(max(block_size, 1), max(num_states, 1))
+
+        best_scores = np.full(scores.shape, -np.inf)
+        best_previous = np.zeros(scores.shape, dtype=np.int32)
+
+        for start in range(0, num_states, block_size):
+            end = min(start + block_size, num_states)
+            candidates = scores[..., start:end, np.newaxis] + log_a[start:end]
+
+            # `argmax` picks the earliest of equal values, as `max` does in
+            # `viterbi`, and a later block only wins with a strictly better
+            # score. States that can't be reached keep the back pointer 0.
+            block_previous = candidates.argmax(axis=-2)
+            block_scores = np.take_along_axis(
+                candidates,
+                block_previous[..., np.newaxis, :],
+                axis=-2
+            )[..., 0, :]
+
+            better = block_scores > best_scores
+            best_scores[better] = block_scores[better]
+            best_previous[better] = block_previous[better] + start
+
+        return (best_scores, best_previous)
+
+    predecessors = compiled.predecessors
+
+    best_scores = np.full(scores.shape, -np.inf)
+    best_previous = np.zeros(scores.shape, dtype=np.int32)
+    if predecessors.nnz == 0:
+        return (best_scores, best_previous)
+
+    # The score of every nonzero transition, with the transitions into each
+    # state next to each other.
+    values = scores[..., predecessors.indices] + predecessors.log_probabilities
+
+    list_scores = np.maximum.reduceat(values, predecessors.starts, axis=-1)
+
+    # The earliest transition reaching the best score, in each list.
+    is_best = values == np.repeat(list_scores, predecessors.counts, axis=-1)
+    positions = np.where(is_best, np.arange(predecessors.nnz), predecessors.nnz)
+    first_best = np.minimum.reduceat(positions, predecessors.starts, axis=-1)
+
+    list_previous = predecessors.indices[first_best]
+    list_previous[list_scores == -np.inf] = 0
+
+    best_scores[..., predecessors.nonempty] = list_scores
+    best_previous[..., predecessors.nonempty] = list_previous
+
+    return (best_scores, best_previous)
+
+
+def backtrack_path(back_pointers, end_state):
+    """
+    Follow the back pointers, a T×S array giving the best previous state for
+    each state at each time step, from the given state at the last time step
+    back to the first. Returns the array of state numbers on the path.
+    """
+
+    num_steps = back_pointers.shape[0]
+
+    path = np.empty(num_steps, dtype=np.int32)
+    state = end_state
+    for t in range(num_steps - 1, -1, -1):
+        path[t] = state
+        state = back_pointers[t, state]
+
+    return path
+
+
 if __name__ == '__main__':
     sound_samples = [
         # Technically, the speaker might have said 'auto', but based on the
@@ -113,8 +290,10 @@ if __name__ == '__main__':
     for sample in sound_samples:
         greedy_path = greedy(SPEECH_RECOGNITION_HMM, sample)
         viterbi_path = viterbi(SPEECH_RECOGNITION_HMM, sample)
+        log_space_path = viterbi_log_space(SPEECH_RECOGNITION_HMM, sample)
 
         print(f"SAMPLE:  {'  '.join(sample)}")
         print(f"  GREEDY :  {'  '.join(greedy_path)}")
         print(f"  VITERBI:  {'  '.join(viterbi_path)}")
+        print(f"  LOG    :  {'  '.join(log_space_path)}")
         print()